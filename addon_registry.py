@@ -44,6 +44,11 @@ default_configuration = {
             "url": r"https://raw.githubusercontent.com/Bloutiouf/blender-addon-registry/master/addons.json",
             # link showing up when there is an error, do not define to hide the button
             "report-url": r"https://github.com/Bloutiouf/blender-addon-registry/issues/new"
+            # URL or file path of the manifest listing the deltas since the previous revisions, do not define to
+            # download the whole registry each time it changes
+            # "manifest-url": r"https://example.com/addons.manifest.json"
+            # URLs or directories where the addons of the registry are mirrored, under the file name of their URL
+            # "mirrors": [r"\\fileserver\addons"]
         }
     ],
     # set of proxies
@@ -54,23 +59,70 @@ default_configuration = {
     # }
     # seconds waiting to establish the connection, set to None to wait forever
     "requests-timeout": 4,
+    # validators of the last downloaded registries, so that unchanged registries are not downloaded again
+    "registries-cache": {},
+    # number of registries downloaded at the same time
+    "registries-concurrency": 4,
+    # number of addons downloaded at the same time when updating
+    "install-concurrency": 8,
+    # number of mirrors of an addon raced for the first bytes, the fastest is used; 1 uses the mirror with the lowest
+    # measured latency, the others are tried in turn if it fails
+    "mirrors-race": 2,
+    # bytes read at once when downloading an addon
+    "download-chunk-size": 1048576,
+    # directory of the downloaded addons, named by their hash, None to use scripts/addons/.addon_registry_cache/downloads
+    "download-cache": None,
+    # bytes kept in the download cache, the least recently used addons are removed first
+    "download-cache-size": 536870912,
+    # directory shared with other machines, e.g. on a network drive, checked after the download cache
+    "shared-download-cache": None,
+    # number of threads extracting the members of a large zip archive
+    "extract-concurrency": 4,
+    # reload all the scripts after an install, otherwise only the updated addons which are enabled are reloaded
+    "reload-scripts": False,
+    # number of addons shown at once in the panel
+    "page-size": 25,
+    # JSON-lines file where the timings of the registry operations are appended, None to only keep the latest in memory
+    "metrics-log": None,
+    # update the database on a worker thread when Blender starts, so that startup does not wait for the registries
+    "background-refresh": True,
 }
 
-import addon_utils
-import bpy
+import argparse
+import array
+import ast
+import bisect
+import collections
+import concurrent.futures
 import copy
 import hashlib
 import json
 import os
+import pickle
+import queue
 import requests
 import shutil
 import subprocess
+import sys
+import tarfile
 import tempfile
+import threading
+import time
+import traceback
 import zipfile
-from bpy.props import *
-from bpy.types import Panel, Operator, USERPREF_HT_header, WindowManager
+import zlib
 from string import Template
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
+
+try:
+    import addon_utils
+    import bpy
+    from bpy.props import *
+    from bpy.types import Panel, Operator, USERPREF_HT_header, WindowManager
+except ImportError:
+    # outside of Blender, only the core functions and the command line are available, see main
+    addon_utils = None
+    bpy = None
 
 ERROR_NONE = 0
 ERROR_EXTRACT_MANUALLY = 1
@@ -81,6 +133,8 @@ ERROR_FAILED_RETRIEVE_ADDON_LIST = 5
 ERROR_HASH_MISMATCH = 6
 ERROR_NO_HASH = 7
 ERROR_NOT_IN_REGISTRY = 8
+ERROR_MISSING_ADDON = 9
+ERROR_LOCK_MISMATCH = 10
 
 error_titles = [
     None,
@@ -91,7 +145,9 @@ error_titles = [
     "Failed to retrieve the addon list.",
     "Hash mismatch;",
     "The registry record is not hashed.",
-    "Addon is not in the registry."
+    "Addon is not in the registry.",
+    "The archive does not contain the addon.",
+    "The registry does not have the locked version of the addon."
 ] 
 
 lastError = ERROR_NONE
@@ -100,272 +156,2169 @@ configuration = copy.deepcopy(default_configuration)
 
 sorted_addons = []
 
+# hash algorithms accepted in the registry records, named as by index.js --hash (Node.js crypto) with their hashlib name,
+# the fastest first, weak algorithms such as md5 or sha1 are not accepted
+hash_algorithms = [
+    ("blake2b512", "blake2b"),
+    ("blake2s256", "blake2s"),
+    ("sha512", "sha512"),
+    ("sha384", "sha384"),
+    ("sha256", "sha256"),
+    ("sha3-512", "sha3_512"),
+    ("sha3-256", "sha3_256"),
+]
+
+# chunks waiting to be hashed by the worker thread of a download, see start_hashing
+hashing_queue_size = 4
+
+# latest timings of the registry operations, see finish_metric
+metrics = collections.deque(maxlen=256)
+metrics_lock = threading.Lock()
+
+# metric being measured by each thread, so that the counters are updated without passing it around
+current_metric = threading.local()
+
+# draws are only recorded when they are slower than that, otherwise the panel would fill the metrics
+slow_draw_duration = 0.01
+last_draw_duration = None
+
+# Blender scripts directory, set by the command line, otherwise the one of Blender
+scripts_dir = None
+
+# keys of the configuration which are stored in the database cache instead of .addon_registry
+database_keys = ("addons", "registries-cache")
+
+# bumped when the layout of the snapshot or of the search index changes
+database_snapshot_version = 2
+
+# the database is read on first use, see ensure_database
+database_loaded = False
+database_lock = threading.Lock()
+
+# names of the addons whose box is expanded in the panel
+expanded_addons = set()
+
+# tarfile compression of the archive formats which are extracted in-process, see get_archive_format
+tar_modes = {"tar": "", "gz": "gz", "bz2": "bz2", "xz": "xz"}
+
+# bytes needed to recognize an archive, the tar magic is at offset 257
+archive_head_size = 262
+
+# zip archives smaller than that are extracted on a single thread
+parallel_extract_min_size = 4194304
+
+# replaced modules waiting to be deleted by a worker thread, see delete_in_background
+retired_modules = []
+retired_modules_lock = threading.Lock()
+retired_modules_thread = None
+
+# installed modules of each addon directory, with their bl_info version, see scan_installed_addons
+installed_addons_dirs = None
+installed_addons = dict()
+installed_addons_scanned = set()
+installed_addons_version = 2
+
+# incremented each time installed_addons changes
+installed_addons_revision = 0
+
+# incremented each time the database is loaded or changed
+database_revision = 0
+
+# normalized versions of the registry records, see normalize_version
+available_versions = dict()
+
+# names of the installed addons which have a newer version in the registry, rebuilt only when the database or the
+# installed addons change, see get_updates_available
+updates_available = set()
+updates_available_key = None
+
+# rows of the addon panel, rebuilt only when the database or the installed modules change
+view_model = None
+view_model_key = None
+filtered_rows = []
+filtered_rows_key = None
+
+# categories and trigrams of the sorted addons, rebuilt when the database changes
+search_index = None
+search_index_revision = None
+
+background_refresh_interval = 0.5
+background_refresh_results = queue.Queue()
+background_refresh_thread = None
+
+session = None
+session_lock = threading.Lock()
+
+# a download at a time per hash, so that bundled addons share their partial download and their cache blob
+download_locks = dict()
+download_locks_lock = threading.Lock()
+
+# seconds after which a partial download which has not been resumed is deleted
+partial_download_expiry = 7 * 86400
+
+# latency and failures of the mirrors by origin, loaded from .addon_registry_cache/mirrors.json on first use
+mirror_scores = None
+mirror_scores_lock = threading.Lock()
+
+# weight of the latest measure in the latency of a mirror
+mirror_latency_weight = 0.3
+
+# seconds after which the failures of a mirror are forgotten
+mirror_failure_expiry = 3600
+
 def get_addon_dir(dir="addons_extern", create=False):
-    addon_dir = os.path.join(bpy.utils.script_path_user(), dir)
+    addon_dir = os.path.join(scripts_dir or bpy.utils.script_path_user(), dir)
     if create and not os.path.isdir(addon_dir):
         os.makedirs(addon_dir, exist_ok=True)
     return addon_dir
 
-def install(addon_name):
+# connections are kept alive and shared between the worker threads
+def get_session():
+    global session
+    with session_lock:
+        if session is None:
+            pool_size = max(configuration["registries-concurrency"], 10)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        return session
+
+# starts measuring a phase on the current thread, nested phases are measured separately
+def start_metric():
+    metric = {"start": time.perf_counter(), "counters": dict(), "previous": getattr(current_metric, "metric", None)}
+    current_metric.metric = metric
+    return metric
+
+# adds to a counter of the phase measured on the current thread, if any
+def count_metric(name, value):
+    metric = getattr(current_metric, "metric", None)
+    if metric is not None:
+        metric["counters"][name] = metric["counters"].get(name, 0) + value
+
+def finish_metric(metric, phase, **fields):
+    duration = time.perf_counter() - metric["start"]
+    if getattr(current_metric, "metric", None) is metric:
+        current_metric.metric = metric["previous"]
+    
+    record = {"time": time.time(), "phase": phase, "duration": duration}
+    record.update(metric["counters"])
+    record.update(fields)
+    if record.get("bytes", 0) and duration > 0:
+        record["throughput"] = record["bytes"] / duration
+    
+    with metrics_lock:
+        metrics.append(record)
+        if configuration["metrics-log"]:
+            try:
+                with open(configuration["metrics-log"], 'a', encoding="utf-8") as f:
+                    f.write(json.dumps(record, sort_keys=True) + "\n")
+            except:
+                pass
+    return record
+
+# the exception being handled, for the metrics of the failures which are otherwise only an error code
+def describe_exception():
+    return traceback.format_exception_only(*sys.exc_info()[:2])[-1].strip()
+
+# forgets a phase which is not worth a record
+def cancel_metric(metric):
+    if getattr(current_metric, "metric", None) is metric:
+        current_metric.metric = metric["previous"]
+
+def finish_draw_metric(metric):
+    global last_draw_duration
+    last_draw_duration = time.perf_counter() - metric["start"]
+    if last_draw_duration >= slow_draw_duration:
+        finish_metric(metric, "panel.draw")
+    else:
+        cancel_metric(metric)
+
+def export_metrics(path):
+    with metrics_lock:
+        records = list(metrics)
+    write_file_atomically(path, "".join(json.dumps(record, sort_keys=True) + "\n" for record in records))
+
+def format_metric(record):
+    details = []
+    for key in ("registry", "addons", "bytes", "throughput", "hash", "error", "exception"):
+        value = record.get(key, None)
+        if not value:
+            continue
+        if key == "addons":
+            value = ", ".join(value)
+        elif key == "bytes":
+            value = "%d bytes" % value
+        elif key == "throughput":
+            value = "%.1f MB/s" % (value / 1000000)
+        elif key == "hash":
+            value = "hash %.1f ms" % (value * 1000)
+        elif key == "error":
+            value = error_titles[value]
+        details.append(str(value))
+    return " ".join([record["phase"], "%.1f ms" % (record["duration"] * 1000)] + details)
+
+def get_cache_dir(dir="registries", create=False):
+    cache_dir = os.path.join(get_addon_dir(dir="addons"), ".addon_registry_cache", dir)
+    if create and not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+def get_registry_cache_path(url):
+    return os.path.join(get_cache_dir(), hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+def write_file_atomically(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    try:
+        if isinstance(content, bytes):
+            f = os.fdopen(fd, 'wb')
+        else:
+            f = os.fdopen(fd, 'w', encoding="utf-8")
+        with f:
+            f.write(content)
+        os.replace(temp_path, path)
+    except:
+        os.remove(temp_path)
+        raise
+
+# the hash of the record, as the digest for sha256, so that the names of the downloads do not change, or as
+# algorithm-digest for the other algorithms, None if the record has no accepted hash
+def get_hash_key(addon):
+    for algorithm, hashlib_name in hash_algorithms:
+        if algorithm in addon and hashlib_name in hashlib.algorithms_available:
+            digest = str(addon[algorithm]).lower()
+            return digest if algorithm == "sha256" else "%s-%s" % (algorithm, digest)
+    return None
+
+# the hash key of the record matching a locked hash, given as a bare digest of any algorithm or as algorithm-digest
+# like get_hash_key, None if the record does not have it
+def get_locked_hash_key(addon, locked):
+    locked = str(locked).lower()
+    algorithm, digest = locked.rsplit("-", 1) if "-" in locked else (None, locked)
+    for name, hashlib_name in hash_algorithms:
+        if (algorithm is None or algorithm == name) and str(addon.get(name, "")).lower() == digest and hashlib_name in hashlib.algorithms_available:
+            return digest if name == "sha256" else "%s-%s" % (name, digest)
+    return None
+
+# the chunks are hashed by a worker thread while the next ones are read, hashlib releases the GIL on large buffers
+def start_hashing(hash):
+    algorithm = hash.rsplit("-", 1)[0] if "-" in hash else "sha256"
+    hasher = {
+        "algorithm": algorithm,
+        "hash": hashlib.new(dict(hash_algorithms)[algorithm]),
+        "chunks": queue.Queue(maxsize=hashing_queue_size),
+        "time": 0.0,
+    }
+    
+    def run():
+        while True:
+            chunk = hasher["chunks"].get()
+            if chunk is None:
+                return
+            start = time.perf_counter()
+            hasher["hash"].update(chunk)
+            hasher["time"] += time.perf_counter() - start
+    
+    hasher["thread"] = threading.Thread(target=run, name="addon_registry_hash", daemon=True)
+    hasher["thread"].start()
+    return hasher
+
+def update_hashing(hasher, chunk):
+    hasher["chunks"].put(chunk)
+
+# returns the hash in the same form as get_hash_key
+# must be called once the hasher is no longer used, even on failure, to stop its thread
+def finish_hashing(hasher):
+    hasher["chunks"].put(None)
+    hasher["thread"].join()
+    count_metric("hash", hasher["time"])
+    digest = hasher["hash"].hexdigest()
+    return digest if hasher["algorithm"] == "sha256" else "%s-%s" % (hasher["algorithm"], digest)
+
+# hard links the file when possible, so that the blobs are not copied around on the same file system
+def link_or_copy(source, destination):
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+        return True
+    except OSError:
+        shutil.copyfile(source, destination)
+        return False
+
+# downloads the addon into a temporary file and checks its hash, without touching Blender
+# so that it can run on a worker thread
+# hash is the key the download is verified against, the preferred one of the record by default
+def download_addon(addon_name, hash=None):
+    ensure_database()
     try:
         addon = configuration["addons"][addon_name]
     except:
-        return ERROR_NOT_IN_REGISTRY
+        return ERROR_NOT_IN_REGISTRY, None
+    
+    if hash is None:
+        hash = get_hash_key(addon)
+    if hash is None:
+        return ERROR_NO_HASH, None
+    
+    # the download is staged next to its destination, so that it is moved without being copied
+    try:
+        fd, download_path = tempfile.mkstemp(prefix=".addon_registry-", suffix=".download", dir=get_addon_dir(create=True))
+        os.close(fd)
+    except:
+        return ERROR_FAILED_COPY, None
+    
+    with download_locks_lock:
+        download_lock = download_locks.setdefault(hash, threading.Lock())
+    
+    # archives are extracted while they are downloaded, next to the download, see stage_download
+    extract_dir = None if addon.get("file", False) else get_extract_dir(download_path)
+    
+    with download_lock:
+        error = download_or_copy_from_cache(get_addon_urls(addon), download_path, hash, extract_dir)
+    
+    if error != ERROR_NONE:
+        os.remove(download_path)
+        if extract_dir:
+            remove_module(extract_dir)
+        return error, None
+    return ERROR_NONE, download_path
+
+def download_or_copy_from_cache(urls, download_path, hash, extract_dir):
+    cache_dirs = get_download_cache_dirs()
+    for i, cache_dir in enumerate(cache_dirs):
+        cache_path = os.path.join(cache_dir, hash)
+        if os.path.isfile(cache_path):
+            if verify_cached(cache_path, download_path, hash) == ERROR_NONE:
+                touch_download_cache(cache_path)
+                if i > 0:
+                    store_in_download_cache(download_path, hash, cache_dirs[:i])
+                return ERROR_NONE
+            if i == 0:
+                # corrupted blob
+                try:
+                    os.remove(cache_path)
+                except OSError:
+                    pass
+    
+    error = download_from_mirrors(urls, download_path, hash, extract_dir)
+    if error == ERROR_NONE:
+        store_in_download_cache(download_path, hash, cache_dirs)
+    return error
+
+# a cached blob is linked instead of copied when possible, then only read to be verified
+def verify_cached(cache_path, download_path, hash):
+    try:
+        os.remove(download_path)
+        os.link(cache_path, download_path)
+    except OSError:
+        return download_verified(cache_path, download_path, hash)
     
-    if "sha256" in addon:
-        h = hashlib.sha256()
-        hash = addon["sha256"]
+    hasher = start_hashing(hash)
+    try:
+        write_file(download_path, None, hasher)
+    except:
+        finish_hashing(hasher)
+        error = ERROR_FAILED_COPY
     else:
-        return ERROR_NO_HASH
+        error = ERROR_NONE if finish_hashing(hasher) == hash else ERROR_HASH_MISMATCH
+    
+    if error != ERROR_NONE:
+        # the link must not be written to, as it would change the blob
+        os.remove(download_path)
+        open(download_path, 'wb').close()
+    return error
+
+def download_verified(url, download_path, hash, extract_dir=None):
+    if "://" in url:
+        return download_resumable(url, download_path, hash, extract_dir)
     
-    if "://" in addon["url"]:
+    hasher = start_hashing(hash)
+    try:
+        with open(download_path, 'wb') as file:
+            write_file(url, file, hasher)
+    except:
+        finish_hashing(hasher)
+        return ERROR_FAILED_COPY
+    
+    if finish_hashing(hasher) != hash:
+        return ERROR_HASH_MISMATCH
+    return ERROR_NONE
+
+# the partial download is kept next to the staging file, named by the expected hash, so that a later attempt
+# resumes it with a Range request, from any mirror
+# a whole download is also extracted into extract_dir while it arrives, if it is a tar archive
+# res is the response of open_mirror if the url has already been opened
+def download_resumable(url, download_path, hash, extract_dir, res=None):
+    partial_path = get_partial_path(download_path, hash)
+    offset = os.path.getsize(partial_path) if os.path.isfile(partial_path) else 0
+    
+    if res is None:
         try:
-            res = requests.get(addon["url"], proxies=configuration["requests-proxies"], timeout=configuration["requests-timeout"], stream=True, verify=True)
-            res.raise_for_status()
+            res = open_mirror(url, get_resume_headers(partial_path))
         except:
             return ERROR_FAILED_REQUEST
+    
+    hasher = start_hashing(hash)
+    try:
+        if offset and res.status_code in (206, 416):
+            # the hash state is rebuilt from the partial download
+            write_file(partial_path, None, hasher)
+            mode = 'ab'
+        else:
+            offset = 0
+            mode = 'wb'
         
+        if res.status_code == 206 and not res.headers.get("Content-Range", "").startswith("bytes %d-" % offset):
+            error = ERROR_FAILED_DOWNLOAD
+            os.remove(partial_path)
+        else:
+            error = ERROR_NONE
+            with open(partial_path, mode) as file:
+                if res.status_code != 416:
+                    write_response(res, file, hasher, extract_dir if mode == 'wb' else None)
+    except:
+        # the partial download is kept for the next attempt
+        finish_hashing(hasher)
+        return ERROR_FAILED_DOWNLOAD
+    finally:
+        res.close()
+    
+    digest = finish_hashing(hasher)
+    if error != ERROR_NONE:
+        return error
+    
+    if digest != hash:
+        os.remove(partial_path)
+        if extract_dir:
+            remove_module(extract_dir)
+        if offset:
+            # the file may have changed since the partial download, start over
+            return download_resumable(url, download_path, hash, extract_dir)
+        return ERROR_HASH_MISMATCH
+    
+    os.replace(partial_path, download_path)
+    return ERROR_NONE
+
+def get_partial_path(download_path, hash):
+    return os.path.join(os.path.dirname(download_path), ".addon_registry-%s.partial" % hash)
+
+def get_resume_headers(partial_path):
+    offset = os.path.getsize(partial_path) if os.path.isfile(partial_path) else 0
+    return {"Range": "bytes=%d-" % offset} if offset else {}
+
+# the url of the record first, then its own mirrors, then the mirrors of its registry, where the addon has the file
+# name of its url
+def get_addon_urls(addon):
+    urls = [addon["url"]] + list(addon.get("mirrors", []))
+    
+    url = addon["url"]
+    file_name = os.path.basename(urlparse(url).path if "://" in url else url)
+    for registry in configuration["registries"]:
+        if registry["url"] == addon.get("registry-url", None):
+            for mirror in registry.get("mirrors", []):
+                if "://" in mirror:
+                    urls.append(urljoin(mirror if mirror.endswith("/") else mirror + "/", file_name))
+                else:
+                    urls.append(os.path.join(mirror, file_name))
+    
+    return list(collections.OrderedDict.fromkeys(urls))
+
+# mirrors are scored by origin, i.e. scheme and host for urls, directory for paths
+def get_mirror_origin(url):
+    if "://" in url:
+        parts = urlparse(url)
+        return "%s://%s" % (parts.scheme, parts.netloc)
+    return os.path.dirname(os.path.abspath(url))
+
+def get_mirror_scores_path():
+    return os.path.join(get_addon_dir(dir="addons"), ".addon_registry_cache", "mirrors.json")
+
+# must be called with mirror_scores_lock held
+def get_mirror_scores():
+    global mirror_scores
+    if mirror_scores is None:
         try:
-            fd, download_path = tempfile.mkstemp()
-            with os.fdopen(fd, 'wb') as file:
-                for chunk in res.iter_content(1024): 
-                    if chunk: # filter out keep-alive new chunks
-                        file.write(chunk)
-                        h.update(chunk)
+            with open(get_mirror_scores_path(), 'r', encoding="utf-8") as f:
+                mirror_scores = json.load(f)
         except:
-            os.remove(download_path)
-            return ERROR_FAILED_DOWNLOAD
+            mirror_scores = dict()
+    return mirror_scores
+
+# the latency is averaged over the measures, None records a failure
+def record_mirror_latency(url, latency):
+    with mirror_scores_lock:
+        score = get_mirror_scores().setdefault(get_mirror_origin(url), {"latency": None, "failures": 0})
+        if latency is None:
+            score["failures"] += 1
+        else:
+            if score["latency"] is None:
+                score["latency"] = latency
+            else:
+                score["latency"] += mirror_latency_weight * (latency - score["latency"])
+            score["failures"] = 0
+        score["time"] = time.time()
+
+def save_mirror_scores():
+    with mirror_scores_lock:
+        if mirror_scores is None:
+            return
+        content = json.dumps(mirror_scores, sort_keys=True)
+    try:
+        write_file_atomically(get_mirror_scores_path(), content)
+    except:
+        pass
+
+# the mirrors which failed recently come last, the others by latency, the unmeasured ones first so that they get
+# measured, the order of the urls breaks the ties
+def rank_mirrors(urls):
+    now = time.time()
+    with mirror_scores_lock:
+        scores = get_mirror_scores()
+        keys = dict()
+        for url in urls:
+            score = scores.get(get_mirror_origin(url), None)
+            if score is None:
+                keys[url] = (0, 0.0)
+            else:
+                failures = score["failures"] if now - score.get("time", 0) < mirror_failure_expiry else 0
+                keys[url] = (failures, score["latency"] or 0.0)
+    return sorted(urls, key=lambda url: keys[url])
+
+# waits for the first bytes of the mirror, returns the streamed response of a url, or None for a path
+# raises if the mirror cannot be read
+def open_mirror(url, headers):
+    if "://" not in url:
+        with open(url, 'rb') as f:
+            f.read(1)
+        return None
+    
+    res = get_session().get(url, headers=headers, proxies=configuration["requests-proxies"], timeout=configuration["requests-timeout"], stream=True, verify=True)
+    try:
+        if not ("Range" in headers and res.status_code == 416):
+            res.raise_for_status()
+    except:
+        res.close()
+        raise
+    return res
+
+# opens the mirrors at the same time, returns the first one which answers with its response, or None if none does
+# all of them are measured, the responses of the slower ones are closed as they arrive
+def race_mirrors(urls, headers):
+    results = queue.Queue()
     
+    def run(url):
+        start = time.perf_counter()
+        try:
+            res = open_mirror(url, headers)
+        except:
+            record_mirror_latency(url, None)
+            results.put((url, False, None))
+            return
+        record_mirror_latency(url, time.perf_counter() - start)
+        results.put((url, True, res))
+    
+    if len(urls) == 1:
+        run(urls[0])
     else:
+        for url in urls:
+            threading.Thread(target=run, args=(url,), name="addon_registry_mirror", daemon=True).start()
+    
+    for i in range(len(urls)):
+        url, opened, res = results.get()
+        if opened:
+            close_race_losers(results, len(urls) - i - 1)
+            return url, res
+    return None, None
+
+def close_race_losers(results, count):
+    def run():
+        for i in range(count):
+            url, opened, res = results.get()
+            if res is not None:
+                res.close()
+    
+    if count:
+        threading.Thread(target=run, name="addon_registry_mirror", daemon=True).start()
+
+# any mirror can be used as the download is verified, so they are tried from the best ranked until one gives the
+# expected hash, racing the mirrors-race first ones each time
+def download_from_mirrors(urls, download_path, hash, extract_dir):
+    candidates = rank_mirrors(urls)
+    error = ERROR_FAILED_REQUEST
+    try:
+        while candidates:
+            race = candidates[:max(configuration["mirrors-race"], 1)]
+            url, res = race_mirrors(race, get_resume_headers(get_partial_path(download_path, hash)))
+            if url is None:
+                candidates = candidates[len(race):]
+                continue
+            
+            candidates.remove(url)
+            count_metric("mirrors", 1)
+            if res is None:
+                error = download_verified(url, download_path, hash, extract_dir)
+            else:
+                error = download_resumable(url, download_path, hash, extract_dir, res)
+            if error == ERROR_NONE:
+                return error
+            if extract_dir:
+                # the tree extracted while downloading is not verified, the next mirror may not extract at all
+                remove_module(extract_dir)
+            if error != ERROR_HASH_MISMATCH:
+                # a stale copy does not make the whole mirror slower
+                record_mirror_latency(url, None)
+    finally:
+        save_mirror_scores()
+    return error
+
+# streams the response into the file chunk by chunk, hashing while writing, see start_hashing
+# if extract_dir is given, tar archives are extracted into it at the same time, and the directory is left only if
+# the whole archive has been extracted
+def write_response(res, file, hasher, extract_dir=None):
+    if extract_dir:
+        remove_module(extract_dir)
+    
+    head = b""
+    extraction = None
+    try:
+        for chunk in res.iter_content(configuration["download-chunk-size"]):
+            if chunk: # filter out keep-alive new chunks
+                file.write(chunk)
+                update_hashing(hasher, chunk)
+                count_metric("bytes", len(chunk))
+                
+                if extraction:
+                    extraction["writer"].write(chunk)
+                elif extract_dir and head is not None:
+                    head += chunk
+                    if len(head) >= archive_head_size:
+                        extraction = start_streaming_extraction(head, extract_dir)
+                        head = None
+        
+        if extract_dir and head:
+            extraction = start_streaming_extraction(head, extract_dir)
+    finally:
+        if extraction and not finish_streaming_extraction(extraction):
+            remove_module(extract_dir)
+
+# the archive is fed to a thread through a pipe, the thread drains the pipe if it stops early so that the download
+# is never blocked
+def start_streaming_extraction(head, extract_dir):
+    format = get_archive_format(head)
+    if format not in tar_modes:
+        return None
+    
+    read_fd, write_fd = os.pipe()
+    reader = os.fdopen(read_fd, 'rb')
+    extraction = {"writer": os.fdopen(write_fd, 'wb'), "done": False}
+    
+    def run():
         try:
-            fd, download_path = tempfile.mkstemp()
-            with os.fdopen(fd, 'wb') as file:
-                with open(addon["url"], 'rb') as source:
-                    chunk = source.read()
-                    file.write(chunk)
-                    h.update(chunk)
+            with tarfile.open(fileobj=reader, mode="r|" + tar_modes[format]) as tf:
+                extract_tar_members(tf, extract_dir)
+            extraction["done"] = True
         except:
-            os.remove(download_path)
-            return ERROR_FAILED_COPY
+            pass
+        finally:
+            try:
+                while reader.read(65536):
+                    pass
+            finally:
+                reader.close()
     
-    if h.hexdigest() != hash:
-        return ERROR_HASH_MISMATCH
+    extraction["thread"] = threading.Thread(target=run, name="addon_registry_extract", daemon=True)
+    extraction["thread"].start()
+    extraction["writer"].write(head)
+    return extraction
+
+def finish_streaming_extraction(extraction):
+    extraction["writer"].close()
+    extraction["thread"].join()
+    return extraction["done"]
+
+# streams the file at path into the file chunk by chunk, hashing while writing, or only hashing if file is None
+def write_file(path, file, hasher):
+    chunk_size = configuration["download-chunk-size"]
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            if file:
+                file.write(chunk)
+                count_metric("bytes", len(chunk))
+            update_hashing(hasher, chunk)
+
+# the local cache first, then the shared one
+def get_download_cache_dirs():
+    cache_dirs = [configuration["download-cache"] or get_cache_dir(dir="downloads")]
+    if configuration["shared-download-cache"]:
+        cache_dirs.append(configuration["shared-download-cache"])
+    return cache_dirs
+
+# the modification time orders the blobs for the eviction
+def touch_download_cache(cache_path):
+    try:
+        os.utime(cache_path)
+    except OSError:
+        pass
+
+# copies a verified download into the caches which do not have it yet, failures are ignored
+def store_in_download_cache(download_path, hash, cache_dirs):
+    for cache_dir in cache_dirs:
+        cache_path = os.path.join(cache_dir, hash)
+        if os.path.isfile(cache_path):
+            continue
+        
+        temp_path = None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(prefix=".addon_registry-", suffix=".part", dir=cache_dir)
+            os.close(fd)
+            link_or_copy(download_path, temp_path)
+            os.replace(temp_path, cache_path)
+        except:
+            if temp_path and os.path.isfile(temp_path):
+                os.remove(temp_path)
+    
+    evict_download_cache(cache_dirs[0])
+
+# removes the least recently used blobs of the local cache until it fits in its size
+# the partial downloads count in the size as well, except the ones being downloaded
+def evict_download_cache(cache_dir):
+    blobs = []
+    total_size = 0
+    try:
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if not name.startswith(".") and os.path.isfile(path):
+                stat = os.stat(path)
+                blobs.append((stat.st_mtime, stat.st_size, path))
+                total_size += stat.st_size
+    except OSError:
+        pass
+    
+    addon_dir = get_addon_dir()
+    try:
+        for name in os.listdir(addon_dir):
+            hash = get_partial_hash(name)
+            if hash is not None and not is_downloading(hash):
+                stat = os.stat(os.path.join(addon_dir, name))
+                blobs.append((stat.st_mtime, stat.st_size, os.path.join(addon_dir, name)))
+                total_size += stat.st_size
+    except OSError:
+        pass
     
-    for mod in addon_utils.modules(refresh=False):
-        if mod.__name__ == addon_name:
-            path = mod.__file__
-            if os.path.isfile(path):
-                os.remove(path)
-                addon_utils.modules(refresh=True)
-            elif os.path.isdir(path):
-                shutil.rmtree(path)
-                addon_utils.modules(refresh=True)
+    blobs.sort()
+    for mtime, size, path in blobs:
+        if total_size <= configuration["download-cache-size"]:
             break
+        try:
+            os.remove(path)
+            total_size -= size
+        except OSError:
+            pass
+
+def get_partial_hash(entry_name):
+    if entry_name.startswith(".addon_registry-") and entry_name.endswith(".partial"):
+        return entry_name[len(".addon_registry-"):-len(".partial")]
+    return None
+
+def is_downloading(hash):
+    with download_locks_lock:
+        download_lock = download_locks.get(hash, None)
+    return download_lock is not None and download_lock.locked()
+
+# the hashes of all the records, in the form of get_hash_key, whatever algorithm is used to verify them
+def get_record_hash_keys():
+    hash_keys = set()
+    for addon in configuration["addons"].values():
+        for algorithm, hashlib_name in hash_algorithms:
+            if algorithm in addon:
+                digest = str(addon[algorithm]).lower()
+                hash_keys.add(digest if algorithm == "sha256" else "%s-%s" % (algorithm, digest))
+    return hash_keys
+
+# partial downloads which have not been resumed for partial_download_expiry, or which no record can resume
+# since its hash changed, are deleted
+def expire_partial_downloads(addon_dir, entry_names):
+    hash_keys = get_record_hash_keys() if database_loaded else None
+    expired_paths = []
+    for entry_name in entry_names:
+        hash = get_partial_hash(entry_name)
+        if hash is None or is_downloading(hash):
+            continue
+        path = os.path.join(addon_dir, entry_name)
+        try:
+            age = time.time() - os.path.getmtime(path)
+        except OSError:
+            continue
+        if age > partial_download_expiry or (hash_keys is not None and hash not in hash_keys):
+            expired_paths.append(path)
+    delete_in_background(expired_paths)
+
+def get_installed_addons_path():
+    return os.path.join(get_addon_dir(dir="addons"), ".addon_registry_cache", "installed.pickle")
+
+# the version of the module is parsed from its source, like addon_utils does, but only when its mtime changes
+def read_installed_addon(name, path, file, mtime):
+    version = []
+    category = None
+    try:
+        with open(file, 'r', encoding="utf-8") as f:
+            source = f.read()
+        for node in ast.parse(source).body:
+            if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == "bl_info" for target in node.targets):
+                bl_info = ast.literal_eval(node.value)
+                version = list(bl_info.get("version", ()))
+                category = bl_info.get("category", None)
+                break
+    except:
+        pass
+    return {"name": name, "path": path, "file": file, "mtime": mtime, "version": version, "normalized-version": normalize_version(version), "category": category}
+
+# returns the module path and its source file if the entry is an addon
+def get_addon_entry(addon_dir, entry_name):
+    path = os.path.join(addon_dir, entry_name)
+    if entry_name.endswith(".py"):
+        return entry_name[:-3], path, path
+    init_file = os.path.join(path, "__init__.py")
+    if os.path.isfile(init_file):
+        return entry_name, path, init_file
+    return None
+
+def scan_installed_addon(addon_dir, entry_name, previous_entries):
+    if entry_name.startswith(".") or entry_name == "__pycache__":
+        return None
+    
+    addon_entry = get_addon_entry(addon_dir, entry_name)
+    if not addon_entry:
+        return None
+    
+    name, path, file = addon_entry
+    try:
+        mtime = os.stat(file).st_mtime
+    except OSError:
+        return None
+    
+    entry = previous_entries.get(name, None)
+    if entry and entry["file"] == file and entry["mtime"] == mtime:
+        return entry
+    return read_installed_addon(name, path, file, mtime)
+
+def scan_installed_addons_dir(addon_dir):
+    previous_entries = installed_addons_dirs.get(addon_dir, {}).get("entries", {})
+    entries = dict()
+    try:
+        mtime = os.stat(addon_dir).st_mtime
+        entry_names = sorted(os.listdir(addon_dir))
+    except OSError:
+        mtime = None
+        entry_names = []
     
+    # modules retired by a previous session which ended before deleting them
+    delete_in_background([os.path.join(addon_dir, entry_name) for entry_name in entry_names if entry_name.startswith(".addon_registry-") and entry_name.endswith(".old")])
+    expire_partial_downloads(addon_dir, entry_names)
+    
+    for entry_name in entry_names:
+        entry = scan_installed_addon(addon_dir, entry_name, previous_entries)
+        if entry:
+            entries.setdefault(entry["name"], entry)
+    
+    installed_addons_dirs[addon_dir] = {"mtime": mtime, "entries": entries}
+
+def load_installed_addons():
+    global installed_addons_dirs
+    try:
+        with open(get_installed_addons_path(), 'rb') as f:
+            index = pickle.load(f)
+        if index["version"] != installed_addons_version:
+            raise ValueError("outdated index")
+        installed_addons_dirs = index["dirs"]
+    except:
+        installed_addons_dirs = dict()
+
+def save_installed_addons():
+    index = {"version": installed_addons_version, "dirs": installed_addons_dirs}
+    try:
+        write_file_atomically(get_installed_addons_path(), pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL))
+    except:
+        pass
+
+# the first directory defining a module wins, as in addon_utils
+def merge_installed_addons(addon_dirs):
+    global installed_addons, installed_addons_revision
+    merged = dict()
+    for addon_dir in addon_dirs:
+        for name, entry in installed_addons_dirs.get(addon_dir, {}).get("entries", {}).items():
+            merged.setdefault(name, entry)
+    if merged != installed_addons:
+        installed_addons_revision += 1
+    installed_addons = merged
+
+# keeps installed_addons up to date without addon_utils.modules(refresh=True)
+# each directory is scanned once per session, then only when its mtime changes, and only the changed modules are parsed
+def scan_installed_addons():
+    if installed_addons_dirs is None:
+        load_installed_addons()
+    
+    # only the scans of changed directories are recorded
+    metric = None
+    changed = False
+    signature = get_modules_signature()
+    addon_dirs = [path for path, mtime in signature]
+    for path, mtime in signature:
+        if path not in installed_addons_scanned or installed_addons_dirs.get(path, {}).get("mtime", None) != mtime:
+            if metric is None:
+                metric = start_metric()
+            previous = installed_addons_dirs.get(path, None)
+            scan_installed_addons_dir(path)
+            installed_addons_scanned.add(path)
+            changed = changed or installed_addons_dirs[path] != previous
+    
+    if metric is not None:
+        finish_metric(metric, "installed.scan")
+    
+    if changed or set(installed_addons_dirs) != set(addon_dirs):
+        for path in list(installed_addons_dirs):
+            if path not in addon_dirs:
+                del installed_addons_dirs[path]
+        save_installed_addons()
+    merge_installed_addons(addon_dirs)
+    return installed_addons
+
+# updates only the given modules, e.g. after installing them
+# the directories were scanned before the install, which changed their mtime, so they are not scanned again; only
+# the ones which were not scanned yet are
+def update_installed_addons(names):
+    if installed_addons_dirs is None:
+        load_installed_addons()
+    metric = start_metric()
+    
+    signature = get_modules_signature()
+    addon_dirs = [path for path, mtime in signature]
+    for path, mtime in signature:
+        if path not in installed_addons_scanned:
+            scan_installed_addons_dir(path)
+            installed_addons_scanned.add(path)
+            continue
+        
+        dir_index = installed_addons_dirs.setdefault(path, {"mtime": None, "entries": {}})
+        entries = dir_index["entries"]
+        for name in names:
+            entry = None
+            for entry_name in (name + ".py", name):
+                if os.path.exists(os.path.join(path, entry_name)):
+                    entry = scan_installed_addon(path, entry_name, {})
+                    if entry:
+                        break
+            if entry:
+                entries[name] = entry
+            else:
+                entries.pop(name, None)
+        dir_index["mtime"] = mtime
+    
+    for path in list(installed_addons_dirs):
+        if path not in addon_dirs:
+            del installed_addons_dirs[path]
+    save_installed_addons()
+    merge_installed_addons(addon_dirs)
+    finish_metric(metric, "installed.update", addons=list(names))
+
+def remove_module(path):
+    if os.path.isfile(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path)
+
+# the dot keeps Blender from loading the retired module
+def get_retired_path(path):
+    return os.path.join(os.path.dirname(path), ".addon_registry-" + os.path.basename(path) + ".old")
+
+# the installed module is renamed instead of being removed, the deletion is left to delete_in_background
+def retire_module(path):
+    retired_path = get_retired_path(path)
+    remove_module(retired_path)
+    os.rename(path, retired_path)
+    return retired_path
+
+# deletes the paths on a worker thread, so that an update does not wait for rmtree
+def delete_in_background(paths):
+    global retired_modules_thread
+    with retired_modules_lock:
+        retired_modules.extend(paths)
+        if retired_modules and retired_modules_thread is None:
+            retired_modules_thread = threading.Thread(target=delete_retired_modules, name="addon_registry_delete", daemon=True)
+            retired_modules_thread.start()
+
+def delete_retired_modules():
+    global retired_modules_thread
+    while True:
+        with retired_modules_lock:
+            if not retired_modules:
+                retired_modules_thread = None
+                return
+            path = retired_modules.pop(0)
+        try:
+            remove_module(path)
+        except:
+            pass
+
+def get_extract_dir(download_path):
+    return download_path + ".extract"
+
+# recognizes the archive from its first bytes
+def get_archive_format(head):
+    if head.startswith(b"PK\x03\x04") or head.startswith(b"PK\x05\x06"):
+        return "zip"
+    if head.startswith(b"\x1f\x8b"):
+        return "gz"
+    if head.startswith(b"BZh"):
+        return "bz2"
+    if head.startswith(b"\xfd7zXZ\x00"):
+        return "xz"
+    if head.startswith(b"7z\xbc\xaf\x27\x1c"):
+        return "7z"
+    if head[257:262] == b"ustar":
+        return "tar"
+    return None
+
+# the path of an archive member split in parts, None for junk or for paths escaping the destination
+# drive letters and absolute parts are rejected as well, on Windows they would escape the extraction directory
+def get_member_parts(name):
+    parts = [part for part in name.replace("\\", "/").split("/") if part and part != "."]
+    if not parts or any(part in ("..", "__MACOSX", "__pycache__", ".DS_Store") for part in parts):
+        return None
+    if any(":" in part or os.path.isabs(part) or os.path.splitdrive(part)[0] for part in parts):
+        return None
+    return parts
+
+# the path of a member in the extraction directory, checked to stay inside like zipfile does
+def get_member_path(extract_dir, parts):
+    path = os.path.join(extract_dir, *parts)
+    root = os.path.realpath(extract_dir)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        raise ValueError("%s is outside of %s" % (path, extract_dir))
+    return path
+
+def is_addon_member(parts, addon_names):
+    return parts[0] in addon_names or (parts[0].endswith(".py") and parts[0][:-3] in addon_names)
+
+# members outside of the addons, e.g. readmes or __MACOSX, are skipped
+# archives which do not have the addons at their root are extracted as a whole
+def select_zip_members(zf, addon_names):
+    members = []
+    for info in zf.infolist():
+        parts = get_member_parts(info.filename)
+        if parts and not info.filename.endswith("/"):
+            members.append((parts, info))
+    
+    selected = [(parts, info) for parts, info in members if is_addon_member(parts, addon_names)]
+    return selected or members
+
+# only regular files are extracted, links and devices are skipped
+# works on streams, members are read in order
+def extract_tar_members(tf, extract_dir):
+    chunk_size = configuration["download-chunk-size"]
+    for info in tf:
+        parts = get_member_parts(info.name)
+        if not parts or not info.isfile():
+            continue
+        
+        path = get_member_path(extract_dir, parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with tf.extractfile(info) as source, open(path, 'wb') as file:
+            shutil.copyfileobj(source, file, chunk_size)
+
+def extract_tar(download_path, format, extract_dir):
+    remove_module(extract_dir)
+    try:
+        with tarfile.open(download_path, mode="r|" + tar_modes[format]) as tf:
+            extract_tar_members(tf, extract_dir)
+    except:
+        remove_module(extract_dir)
+        return False
+    return True
+
+# the staged addons are selected the same way select_zip_members selects the members
+def get_staged_entries(addon_names, extract_dir):
+    entry_names = sorted(os.listdir(extract_dir))
+    selected = [entry_name for entry_name in entry_names if is_addon_member([entry_name], addon_names)]
+    return selected or entry_names
+
+# each addon has to be staged as a module or as a package
+def verify_staged(addon_names, extract_dir):
+    for addon_name in addon_names:
+        if not os.path.isfile(os.path.join(extract_dir, addon_name + ".py")) and not os.path.isfile(os.path.join(extract_dir, addon_name, "__init__.py")):
+            return False
+    return True
+
+# swaps the staged addons with the installed ones, each addon is missing only between two renames
+# installed_paths are the modules of the addons before the install, which are retired if they are not replaced,
+# e.g. a single file addon now shipped as a package
+def commit_staged(addon_names, extract_dir, installed_paths):
     addon_dir = get_addon_dir(create=True)
-    base = os.path.join(addon_dir, addon_name)
-    if addon.get("file", False):
-        os.rename(download_path, base + ".py")
-    elif zipfile.is_zipfile(download_path):
-        with zipfile.ZipFile(download_path) as zf:
-            zf.extractall(addon_dir)
-    else:
+    
+    # (path, staged path or None, retired path or None) of each rename, undone in reverse order if one fails
+    swaps = []
+    replaced_paths = set()
+    try:
+        for entry_name in get_staged_entries(addon_names, extract_dir):
+            path = os.path.join(addon_dir, entry_name)
+            staged_path = os.path.join(extract_dir, entry_name)
+            retired_path = retire_module(path) if os.path.lexists(path) else None
+            swaps.append((path, None, retired_path))
+            os.rename(staged_path, path)
+            swaps[-1] = (path, staged_path, retired_path)
+            replaced_paths.add(os.path.normcase(os.path.abspath(path)))
+        
+        for path in installed_paths:
+            if os.path.normcase(os.path.abspath(path)) not in replaced_paths and os.path.lexists(path):
+                swaps.append((path, None, retire_module(path)))
+    except:
+        rollback_staged(swaps)
+        raise
+    
+    # the old modules are only deleted once all of them have been replaced
+    # the staging directory still holds the members which are not addons
+    delete_in_background([retired_path for path, staged_path, retired_path in swaps if retired_path] + [extract_dir])
+    return ERROR_NONE
+
+# puts the staged modules back into the staging directory and the retired ones back in place
+def rollback_staged(swaps):
+    for path, staged_path, retired_path in reversed(swaps):
         try:
-            subprocess.check_call(["7z", "x", "-o" + addon_dir, "-y", download_path])
-            os.remove(download_path)
+            if staged_path:
+                os.rename(path, staged_path)
+            if retired_path:
+                os.rename(retired_path, path)
         except:
-            bpy.ops.addon_registry.save_archive("INVOKE_DEFAULT", download_path=download_path, filepath=os.path.join(addon_dir, os.path.basename(urlparse(addon["url"]).path)))
-            return ERROR_EXTRACT_MANUALLY
+            pass
+
+def get_file_crc(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(configuration["download-chunk-size"]), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc & 0xffffffff
+
+# the file of the installed module at the same place as the member, if any
+def get_reusable_path(parts, reuse):
+    top = parts[0]
+    if top.endswith(".py") and len(parts) == 1:
+        installed_path = reuse.get(top[:-3], None)
+        return installed_path if installed_path and os.path.isfile(installed_path) else None
+    installed_path = reuse.get(top, None)
+    return os.path.join(installed_path, *parts[1:]) if installed_path else None
+
+# each batch has its own handle, as a ZipFile cannot be read from several threads
+# the directories are created beforehand by extract_zip, ZipFile.extract would race on them
+def extract_zip_members(download_path, members, extract_dir, reuse):
+    chunk_size = configuration["download-chunk-size"]
+    with zipfile.ZipFile(download_path) as zf:
+        for parts, info in members:
+            path = get_member_path(extract_dir, parts)
+            reusable_path = get_reusable_path(parts, reuse)
+            if reusable_path and os.path.isfile(reusable_path) and os.path.getsize(reusable_path) == info.file_size and get_file_crc(reusable_path) == info.CRC:
+                # the installed module stays intact until the staged one replaces it
+                link_or_copy(reusable_path, path)
+            else:
+                with zf.open(info) as source, open(path, 'wb') as file:
+                    shutil.copyfileobj(source, file, chunk_size)
+
+# zlib releases the GIL while inflating, so the members are extracted by threads
+def extract_zip(addon_names, download_path, extract_dir, reuse):
+    with zipfile.ZipFile(download_path) as zf:
+        members = select_zip_members(zf, addon_names)
+    
+    for directory in {os.path.dirname(get_member_path(extract_dir, parts)) for parts, info in members}:
+        os.makedirs(directory, exist_ok=True)
+    
+    workers = min(max(configuration["extract-concurrency"], 1), len(members))
+    if workers <= 1 or sum(info.compress_size for parts, info in members) < parallel_extract_min_size:
+        extract_zip_members(download_path, members, extract_dir, reuse)
+        return
+    
+    # the largest members are spread first so that the batches are balanced
+    members.sort(key=lambda member: member[1].compress_size, reverse=True)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(extract_zip_members, download_path, members[i::workers], extract_dir, reuse) for i in range(workers)]
+        for future in futures:
+            future.result()
+
+# extracts the download of the addons sharing the same archive into its staging directory, without touching the
+# installed addons nor Blender
+# the download is left in place if it has to be extracted manually
+# reuse maps the addon names to their installed modules, whose unchanged files are linked instead of extracted
+def stage_download(addon_names, download_path, reuse):
+    addon = configuration["addons"][addon_names[0]]
+    extract_dir = get_extract_dir(download_path)
+    
+    # tar archives have usually been extracted during the download
+    if not os.path.isdir(extract_dir):
+        if addon.get("file", False):
+            os.makedirs(extract_dir)
+            for addon_name in addon_names:
+                shutil.copyfile(download_path, os.path.join(extract_dir, addon_name + ".py"))
+        else:
+            with open(download_path, 'rb') as file:
+                format = get_archive_format(file.read(archive_head_size))
+            
+            if format != "zip" and zipfile.is_zipfile(download_path):
+                # e.g. self-extracting archives
+                format = "zip"
+            
+            if format == "zip":
+                extract_zip(addon_names, download_path, extract_dir, reuse)
+            elif format not in tar_modes or not extract_tar(download_path, format, extract_dir):
+                # last resort
+                try:
+                    subprocess.check_call(["7z", "x", "-o" + extract_dir, "-y", download_path])
+                except:
+                    remove_module(extract_dir)
+                    return ERROR_EXTRACT_MANUALLY
     
+    if not verify_staged(addon_names, extract_dir):
+        remove_module(extract_dir)
+        return ERROR_MISSING_ADDON
+    
+    os.remove(download_path)
     return ERROR_NONE
 
-def is_newer_version(available, installed):
-    for available_i, installed_i in zip(available, installed):
-        if available_i > installed_i:
-            return True
+def save_archive_manually(addon_name, download_path):
+    addon = configuration["addons"][addon_name]
+    bpy.ops.addon_registry.save_archive("INVOKE_DEFAULT", download_path=download_path, filepath=os.path.join(get_addon_dir(), os.path.basename(urlparse(addon["url"]).path)))
+
+# the plan is plain data so that it can be inspected before being executed
+# addons sharing the same hash, e.g. bundled addons, share a single download and extraction
+# each group downloads, then extracts into a staging directory, then swaps it with the installed modules, independently
+# of the other groups
+# hash_keys maps some addon names to the hash key their download is verified against, e.g. the locked ones
+def plan_install(addon_names, installed, hash_keys=None):
+    ensure_database()
+    
+    errors = dict()
+    groups = []
+    group_names = dict()
+    for addon_name in addon_names:
+        addon = configuration["addons"].get(addon_name, None)
+        if addon is None:
+            errors[addon_name] = ERROR_NOT_IN_REGISTRY
+        elif (hash_keys or {}).get(addon_name, None) is None and get_hash_key(addon) is None:
+            errors[addon_name] = ERROR_NO_HASH
+        else:
+            key = (hash_keys or {}).get(addon_name, None) or get_hash_key(addon)
+            if key not in group_names:
+                group_names[key] = []
+                groups.append(key)
+            if addon_name not in group_names[key]:
+                group_names[key].append(addon_name)
+    
+    steps = []
+    for key in groups:
+        names = group_names[key]
+        download_id = "download:" + key
+        steps.append({"id": download_id, "action": "download", "key": key, "names": names, "requires": []})
         
-        if available_i < installed_i:
-            return False
+        reuse = {addon_name: installed[addon_name]["path"] for addon_name in names if addon_name in installed}
+        extract_id = "extract:" + key
+        steps.append({"id": extract_id, "action": "extract", "key": key, "names": names, "reuse": reuse, "requires": [download_id]})
+        steps.append({"id": "commit:" + key, "action": "commit", "key": key, "names": names, "installed_paths": list(reuse.values()), "requires": [extract_id]})
+    
+    return {"steps": steps, "errors": errors}
+
+def run_install_step(step, downloads):
+    metric = start_metric()
+    try:
+        error = run_install_action(step, downloads)
+    except:
+        finish_metric(metric, "install." + step["action"], addons=step["names"], error=ERROR_FAILED_COPY, exception=describe_exception())
+        raise
+    finish_metric(metric, "install." + step["action"], addons=step["names"], error=error)
+    return error
+
+def run_install_action(step, downloads):
+    action = step["action"]
+    if action == "download":
+        error, downloads[step["key"]] = download_addon(step["names"][0], step["key"])
+        return error
+    if action == "extract":
+        return stage_download(step["names"], downloads[step["key"]], step["reuse"])
+    if action == "commit":
+        return commit_staged(step["names"], get_extract_dir(downloads[step["key"]]), step["installed_paths"])
+    raise ValueError(action)
+
+# runs the steps as soon as the steps they require have succeeded, on a pool bounded by install-concurrency
+# returns the error of each addon, and the downloads which have to be extracted manually
+def execute_install_plan(plan):
+    outcomes = dict()
+    downloads = dict()
+    pending = list(plan["steps"])
+    running = dict()
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(configuration["install-concurrency"], 1)) as executor:
+        while pending or running:
+            for step in list(pending):
+                if all(required in outcomes for required in step["requires"]):
+                    pending.remove(step)
+                    failures = [outcomes[required] for required in step["requires"] if outcomes[required] != ERROR_NONE]
+                    if failures:
+                        outcomes[step["id"]] = failures[0]
+                    else:
+                        running[executor.submit(run_install_step, step, downloads)] = step
             
-    return len(available) > len(installed)
+            if not running:
+                continue
+            
+            done, not_done = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                step = running.pop(future)
+                try:
+                    outcomes[step["id"]] = future.result()
+                except:
+                    outcomes[step["id"]] = ERROR_FAILED_COPY
+    
+    results = dict(plan["errors"])
+    manual_downloads = dict()
+    for step in plan["steps"]:
+        if step["action"] == "commit":
+            error = outcomes[step["id"]]
+            for addon_name in step["names"]:
+                results[addon_name] = error
+            
+            download_path = downloads.get(step["key"], None)
+            if error == ERROR_EXTRACT_MANUALLY:
+                manual_downloads[step["names"][0]] = download_path
+            elif download_path:
+                remove_module(download_path)
+            if error != ERROR_NONE and download_path:
+                remove_module(get_extract_dir(download_path))
+    
+    return results, manual_downloads
+
+def install(addon_name, manual_downloads=None):
+    return install_many([addon_name], manual_downloads)[addon_name]
+
+# returns the error of each addon, the caller refreshes the modules once
+# the downloads to extract manually are offered to be saved in Blender, and are added to manual_downloads if given,
+# so that the caller finds them outside of Blender
+def install_many(addon_names, manual_downloads=None):
+    results, downloads = execute_install_plan(plan_install(addon_names, scan_installed_addons()))
+    for addon_name, download_path in downloads.items():
+        if bpy is not None:
+            save_archive_manually(addon_name, download_path)
+    if manual_downloads is not None:
+        manual_downloads.update(downloads)
+    update_installed_addons(addon_names)
+    return results
+
+# makes Blender use the installed addons, reloading all the scripts only if the configuration asks for it
+def refresh_installed_addons(context, addon_names):
+    if configuration["reload-scripts"]:
+        addon_utils.modules(refresh=True)
+        bpy.utils.refresh_script_paths()
+        bpy.ops.script.reload()
+    else:
+        # e.g. addons_extern created by the first install, its addons could not be enabled before a restart
+        addon_dir = os.path.normcase(os.path.abspath(get_addon_dir()))
+        if (os.path.isdir(addon_dir) and
+            (addon_dir not in {os.path.normcase(os.path.abspath(path)) for path in sys.path} or
+            addon_dir not in {os.path.normcase(os.path.abspath(path)) for path in addon_utils.paths()})):
+            bpy.utils.refresh_script_paths()
+        
+        # Blender lists the new addons only once its module cache is refreshed
+        known_names = {module.__name__ for module in addon_utils.modules(refresh=False)}
+        if any(addon_name not in known_names for addon_name in addon_names):
+            addon_utils.modules(refresh=True)
+        
+        enabled_addon_names = {addon.module for addon in context.user_preferences.addons}
+        for addon_name in addon_names:
+            if addon_name in enabled_addon_names:
+                addon_utils.disable(addon_name)
+                addon_utils.enable(addon_name, default_set=True)
+    invalidate_view_model()
+
+# versions are compared as tuples of integers without trailing zeros, so that (1, 2) and (1, 2, 0) are the same,
+# and so that a malformed part, e.g. "2b", does not break the comparison
+def normalize_version(version):
+    if isinstance(version, str):
+        version = version.split(".")
+    elif not isinstance(version, (list, tuple)):
+        version = [version]
+    
+    parts = []
+    for part in version:
+        if isinstance(part, int):
+            parts.append(part)
+        else:
+            digits = ""
+            for c in str(part).strip():
+                if not c.isdigit():
+                    break
+                digits += c
+            parts.append(int(digits) if digits else 0)
+    
+    while parts and parts[-1] == 0:
+        parts.pop()
+    return tuple(parts)
+
+def is_newer_version(available, installed):
+    return normalize_version(available) > normalize_version(installed)
+
+# the installed addons which can be updated, computed once per database or installed addons change, so that the panel
+# and its header only compare two revisions when drawn
+def get_updates_available():
+    global updates_available, updates_available_key
+    ensure_database()
+    installed = scan_installed_addons() if installed_addons_dirs is None else installed_addons
+    
+    key = (database_revision, installed_addons_revision)
+    if key != updates_available_key:
+        updates_available = {name for name, entry in installed.items()
+            if name in available_versions and available_versions[name] > entry["normalized-version"]}
+        updates_available_key = key
+    return updates_available
+
+def get_configuration_path(create=False):
+    return os.path.join(get_addon_dir(dir="addons", create=create), ".addon_registry")
 
+def get_database_path():
+    return os.path.join(get_addon_dir(dir="addons"), ".addon_registry_cache", "database.pickle")
+
+# only the settings are read, the database is read by ensure_database when needed
 def load_configuration():
-    global configuration
+    global configuration, database_loaded
+    
+    configuration = copy.deepcopy(default_configuration)
+    database_loaded = False
     try:
-        with open(os.path.join(get_addon_dir(dir="addons"), ".addon_registry"), 'r') as f:
-            configuration = json.load(f)
-        sort_addonds()
+        with open(get_configuration_path(), 'r') as f:
+            configuration.update(json.load(f))
     except:
-        pass
+        return
+    
+    # older versions and preloaded configurations embed the database
+    if any(configuration[key] for key in database_keys) and not os.path.isfile(get_database_path()):
+        database_loaded = True
+        sort_addonds()
+        save_database()
+        save_configuration()
 
 def save_configuration():
-    sort_addonds()
-    with open(os.path.join(get_addon_dir(dir="addons", create=True), ".addon_registry"), 'w') as f:
-        json.dump(configuration, f)
+    settings = {key: value for key, value in configuration.items() if key not in database_keys}
+    write_file_atomically(get_configuration_path(create=True), json.dumps(settings, indent=4))
+
+# the snapshot is read in one go, it already contains the sorted addons and the search index
+def ensure_database():
+    global available_versions, database_loaded, database_revision, search_index, search_index_revision, sorted_addons
+    
+    if database_loaded:
+        return
+    
+    with database_lock:
+        if database_loaded:
+            return
+        
+        try:
+            with open(get_database_path(), 'rb') as f:
+                snapshot = pickle.load(f)
+            if snapshot["version"] != database_snapshot_version:
+                raise ValueError("outdated snapshot")
+            for key in database_keys:
+                configuration[key] = snapshot[key]
+            sorted_addons = snapshot["sorted-addons"]
+            available_versions = snapshot["available-versions"]
+            database_revision += 1
+            search_index = snapshot["search-index"]
+            search_index_revision = database_revision
+        except:
+            sort_addonds()
+        
+        database_loaded = True
+
+# the snapshot is tagged with the validators of the registries it has been merged from
+def save_database():
+    snapshot = {key: configuration[key] for key in database_keys}
+    snapshot["version"] = database_snapshot_version
+    snapshot["sorted-addons"] = sorted_addons
+    snapshot["available-versions"] = available_versions
+    snapshot["search-index"] = get_search_index()
+    write_file_atomically(get_database_path(), pickle.dumps(snapshot, protocol=pickle.HIGHEST_PROTOCOL))
 
 def sort_addonds():
-    global sorted_addons
+    global available_versions, database_revision, sorted_addons
     sorted_addons = list(configuration["addons"].items())
     sorted_addons.sort(key=lambda pair: pair[1]["info"]["category"] + ": " + pair[1]["info"]["name"])
+    available_versions = {name: normalize_version(addon["info"]["version"]) for name, addon in sorted_addons}
+    database_revision += 1
+
+def invalidate_view_model():
+    global view_model_key
+    view_model_key = None
+
+# the directories searched by Blender, or the user ones outside of Blender
+def get_addon_paths():
+    if addon_utils and not scripts_dir:
+        return addon_utils.paths()
+    return [path for path in (get_addon_dir(dir="addons"), get_addon_dir()) if os.path.isdir(path)]
+
+# addon directories only change when modules are added or removed
+def get_modules_signature():
+    signature = []
+    for path in get_addon_paths():
+        try:
+            signature.append((path, os.stat(path).st_mtime))
+        except OSError:
+            signature.append((path, None))
+    return tuple(signature)
+
+def build_view_model():
+    installed_addons = scan_installed_addons()
+    updates = get_updates_available()
     
+    rows = []
+    installed = set()
+    newer_available = set()
+    for i, (name, addon) in enumerate(sorted_addons):
+        info = addon["info"]
+        
+        installed_addon = installed_addons.get(name, None)
+        installed_version = None
+        is_installed = bool(installed_addon)
+        is_newer_available = False
+        if is_installed:
+            installed_version = installed_addon["version"]
+            is_newer_available = name in updates
+            installed.add(i)
+            if is_newer_available:
+                newer_available.add(i)
+        
+        rows.append({
+            "name": name,
+            "addon": addon,
+            "installed_version": installed_version,
+            "is_installed": is_installed,
+            "is_newer_available": is_newer_available,
+        })
+    
+    return {
+        "rows": rows,
+        "installed": installed,
+        "not_installed": set(range(len(rows))) - installed,
+        "newer_available": newer_available,
+    }
 
-def update_addon_database():
-    global lastError
+def get_search_index():
+    global search_index, search_index_revision
+    ensure_database()
+    if search_index_revision != database_revision:
+        search_index = build_search_index()
+        search_index_revision = database_revision
+    return search_index
+
+def build_search_index():
+    categories = dict()
+    trigrams = dict()
+    texts = []
+    for i, (name, addon) in enumerate(sorted_addons):
+        info = addon["info"]
+        categories.setdefault(info["category"], set()).add(i)
+        
+        text = "\n".join(field.lower() for field in (info["name"], info["author"], info.get("description", None)) if field)
+        texts.append(text)
+        for trigram in {text[j:j + 3] for j in range(len(text) - 2)}:
+            trigrams.setdefault(trigram, []).append(i)
     
-    if not configuration["registries"]:
-        return false
+    # compact arrays are much faster to load from the snapshot than sets
+    trigrams = {trigram: array.array('I', indices) for trigram, indices in trigrams.items()}
+    
+    filter_items = [
+        ("All", "All", "All Addons"),
+        ("New Version Available", "New Version Available", "All New Version Available Addons"),
+        ("Installed", "Installed", "All Installed Addons"),
+        ("Not Installed", "Not Installed", "All Not Installed Addons")
+    ]
+    filter_items.extend([(cat, cat, "") for cat in sorted(categories)])
+    
+    return {
+        "categories": categories,
+        "trigrams": trigrams,
+        "texts": texts,
+        "filter_items": filter_items,
+    }
+
+# indices of the rows whose name, author or description may contain the search, None if the search is too short
+def lookup_trigrams(index, search):
+    if len(search) < 3:
+        return None
+    
+    sets = sorted((index["trigrams"].get(search[j:j + 3], ()) for j in range(len(search) - 2)), key=len)
+    result = set(sets[0])
+    for other in sets[1:]:
+        if not result:
+            break
+        result = {i for i in result if contains_sorted(other, i)}
+    return result
+
+def contains_sorted(indices, i):
+    position = bisect.bisect_left(indices, i)
+    return position < len(indices) and indices[position] == i
+
+def get_view_rows(filter, search):
+    global view_model, view_model_key, filtered_rows, filtered_rows_key
+    ensure_database()
+    
+    key = (database_revision, get_modules_signature())
+    if key != view_model_key:
+        view_model = build_view_model()
+        view_model_key = key
+    
+    key = (view_model_key, filter, search)
+    if key != filtered_rows_key:
+        index = get_search_index()
+        rows = view_model["rows"]
+        
+        if filter == "All":
+            indices = None
+        elif filter == "New Version Available":
+            indices = view_model["newer_available"]
+        elif filter == "Installed":
+            indices = view_model["installed"]
+        elif filter == "Not Installed":
+            indices = view_model["not_installed"]
+        else:
+            indices = index["categories"].get(filter, set())
+        
+        if search:
+            matches = lookup_trigrams(index, search)
+            if matches is not None:
+                indices = matches if indices is None else matches & indices
+            texts = index["texts"]
+            indices = [i for i in (range(len(rows)) if indices is None else sorted(indices)) if search in texts[i]]
+        elif indices is not None:
+            indices = sorted(indices)
+        
+        filtered_rows = rows if indices is None else [rows[i] for i in indices]
+        filtered_rows_key = key
+    
+    return filtered_rows
+
+def read_url(url):
+    if "://" in url:
+        res = get_session().get(url, proxies=configuration["requests-proxies"], timeout=configuration["requests-timeout"], verify=True)
+        res.raise_for_status()
+        count_metric("bytes", len(res.content))
+        return res.text
+    
+    with open(url, 'r') as f:
+        return f.read()
+
+def get_delta_url(manifest_url, manifest, revision):
+    relative_url = manifest.get("deltas", "addons.deltas/") + "%d.json" % revision
+    if "://" in manifest_url:
+        return urljoin(manifest_url, relative_url)
+    return os.path.join(os.path.dirname(manifest_url), relative_url)
+
+def get_registry_journal_path(url):
+    return get_registry_cache_path(url)[:-len(".json")] + ".deltas"
+
+def has_registry_cache(url):
+    return "://" not in url or os.path.isfile(get_registry_cache_path(url))
+
+def fetch_registry_measured(registry, validators):
+    metric = start_metric()
+    try:
+        content, deltas, validators = fetch_registry(registry, validators)
+    except:
+        finish_metric(metric, "registry.fetch", registry=registry["url"], error=ERROR_FAILED_RETRIEVE_ADDON_LIST, exception=describe_exception())
+        raise
+    finish_metric(metric, "registry.fetch", registry=registry["url"], changed=content is not None or deltas is not None)
+    return content, deltas, validators
+
+# returns the content of the registry, the deltas to apply since the last revision, and the new validators
+# both the content and the deltas are None if the registry has not changed since the validators were recorded
+def fetch_registry(registry, validators):
+    url = registry["url"]
+    manifest_url = registry.get("manifest-url", None)
+    if not manifest_url:
+        content, validators = fetch_registry_snapshot(url, validators)
+        return content, None, validators
+    
+    manifest = json.loads(read_url(manifest_url))
+    revision = manifest["revision"]
+    stored_revision = validators.get("revision", None) if validators else None
     
-    success = True
-    addons = configuration["addons"]
+    if stored_revision is not None and has_registry_cache(url):
+        if stored_revision == revision:
+            return None, None, validators
+        
+        if manifest.get("oldest-revision", revision + 1) <= stored_revision + 1 <= revision:
+            deltas = [json.loads(read_url(get_delta_url(manifest_url, manifest, delta_revision)))
+                for delta_revision in range(stored_revision + 1, revision + 1)]
+            if "://" in url:
+                with open(get_registry_journal_path(url), 'a', encoding="utf-8") as f:
+                    for delta in deltas:
+                        f.write(json.dumps(delta, separators=(",", ":")) + "\n")
+            
+            validators = dict(validators)
+            validators["revision"] = revision
+            return None, deltas, validators
+    
+    # the revision is read before the snapshot, so that the deltas published meanwhile are applied again next time
+    content, validators = fetch_registry_snapshot(url, validators)
+    validators = dict(validators)
+    validators["revision"] = revision
+    return content, None, validators
+
+# returns the content of the registry, or None if it has not changed since the validators were recorded
+def fetch_registry_snapshot(url, validators):
+    if "://" in url:
+        cache_path = get_registry_cache_path(url)
+        headers = {}
+        if validators and os.path.isfile(cache_path):
+            if "etag" in validators:
+                headers["If-None-Match"] = validators["etag"]
+            if "last-modified" in validators:
+                headers["If-Modified-Since"] = validators["last-modified"]
+        
+        res = get_session().get(url, headers=headers, proxies=configuration["requests-proxies"], timeout=configuration["requests-timeout"], verify=True)
+        res.raise_for_status()
+        if res.status_code == 304:
+            return None, validators
+        
+        count_metric("bytes", len(res.content))
+        content = res.text
+        write_file_atomically(cache_path, content)
+        journal_path = get_registry_journal_path(url)
+        if os.path.isfile(journal_path):
+            os.remove(journal_path)
+        validators = {}
+        if "ETag" in res.headers:
+            validators["etag"] = res.headers["ETag"]
+        if "Last-Modified" in res.headers:
+            validators["last-modified"] = res.headers["Last-Modified"]
+    
+    else:
+        stat = os.stat(url)
+        current_validators = {"mtime": stat.st_mtime, "size": stat.st_size}
+        if validators and all(validators.get(key, None) == value for key, value in current_validators.items()):
+            return None, validators
+        
+        with open(url, 'r') as f:
+            content = f.read()
+        count_metric("bytes", stat.st_size)
+        validators = current_validators
+    
+    return content, validators
+
+# records of a registry which has not changed, from the response cache and its deltas or from the file itself
+def read_registry(url):
+    if "://" not in url:
+        with open(url, 'r') as f:
+            return json.load(f)
+    
+    with open(get_registry_cache_path(url), 'r') as f:
+        registry_addons = json.load(f)
+    
+    journal_path = get_registry_journal_path(url)
+    if os.path.isfile(journal_path):
+        with open(journal_path, 'r', encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    apply_delta(registry_addons, json.loads(line))
+    
+    return registry_addons
+
+def apply_delta(registry_addons, delta):
+    registry_addons.update(delta.get("changed", {}))
+    for name in delta.get("removed", []):
+        registry_addons.pop(name, None)
+
+# applies the deltas of the registries directly to the database, returns False if a full merge is needed,
+# i.e. when a removed record may be defined by an earlier registry
+def merge_deltas(addons, registries, registries_deltas):
+    order = {registry["url"]: i for i, registry in enumerate(registries)}
+    
+    for registry in registries:
+        url = registry["url"]
+        report_url = registry.get("report-url", None)
+        for delta in registries_deltas.get(url, None) or []:
+            for name, addon in delta.get("changed", {}).items():
+                owner = addons[name].get("registry-url", None) if name in addons else None
+                if owner is None or order.get(owner, -1) <= order[url]:
+                    addon["registry-url"] = url
+                    if report_url:
+                        addon["registry-report-url"] = report_url
+                    addons[name] = addon
+            
+            for name in delta.get("removed", []):
+                if name in addons and addons[name].get("registry-url", None) == url:
+                    if order[url] > 0:
+                        return False
+                    del addons[name]
+    
+    return True
+
+# downloads the registries and merges them into a new database, the configuration is left untouched
+# so that it can run on a worker thread
+# the database is None if no registry has changed
+def fetch_addon_database():
+    ensure_database()
+    
+    error = ERROR_NONE
+    registries = configuration["registries"]
+    registries_cache = configuration["registries-cache"]
+    new_registries_cache = dict()
+    contents = dict()
+    registries_deltas = dict()
+    
+    # the registries are downloaded at the same time, but merged in order
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(configuration["registries-concurrency"], 1)) as executor:
+        futures = []
+        for registry in registries:
+            url = registry["url"]
+            validators = registries_cache.get(url, None)
+            futures.append((url, validators, executor.submit(fetch_registry_measured, registry, validators)))
+        
+        for url, validators, future in futures:
+            try:
+                contents[url], registries_deltas[url], new_registries_cache[url] = future.result()
+            except:
+                error = ERROR_FAILED_RETRIEVE_ADDON_LIST
+                if validators is not None:
+                    new_registries_cache[url] = validators
+    
+    if (all(content is None for content in contents.values()) and
+        set(new_registries_cache) == set(registries_cache)):
+        if all(deltas is None for deltas in registries_deltas.values()):
+            return None, new_registries_cache, error
+        
+        addons = dict(configuration["addons"])
+        if merge_deltas(addons, registries, registries_deltas):
+            return addons, new_registries_cache, error
+    
+    addons = dict(configuration["addons"])
     registries_addons = dict()
     
-    for registry in configuration["registries"]:
+    for registry in registries:
         report_url = registry.get("report-url", None)
         url = registry["url"]
+        if url not in contents:
+            continue
         
+        metric = start_metric()
         try:
-            if "://" in url:
-                res = requests.get(url, proxies=configuration["requests-proxies"], timeout=configuration["requests-timeout"], verify=True)
-                res.raise_for_status()
-                content = res.text
+            content = contents[url]
+            if content is None:
+                registry_addons = read_registry(url)
             else:
-                with open(url, 'r') as f:
-                    content = f.read()
+                registry_addons = json.loads(content)
             
-            registry_addons = json.loads(content)
             registries_addons[url] = registry_addons.keys()
             for name, addon in registry_addons.items():
                 addon["registry-url"] = url
                 if report_url:
                     addon["registry-report-url"] = report_url
                 addons[name] = addon
+            finish_metric(metric, "registry.parse", registry=url, records=len(registry_addons))
         except:
-            lastError = ERROR_FAILED_RETRIEVE_ADDON_LIST
-            success = False
+            error = ERROR_FAILED_RETRIEVE_ADDON_LIST
+            finish_metric(metric, "registry.parse", registry=url, error=error, exception=describe_exception())
+            new_registries_cache.pop(url, None)
     
+    registry_urls = {registry["url"] for registry in registries}
     for name, addon in list(addons.items()):
         url = addon.get("registry-url", None)
         if url:
-            registry_addons = registries_addons[url]
-            if name not in registry_addons:
+            if url not in registry_urls:
+                del addons[name]
+                continue
+            # keep the records of the registries which could not be retrieved
+            registry_addons = registries_addons.get(url, None)
+            if registry_addons is not None and name not in registry_addons:
                 del addons[name]
     
-    configuration["addons"] = addons
-    save_configuration()
-    return success
+    return addons, new_registries_cache, error
 
-class AddonRegistryPanel(Panel):
-    """Addon registry panel, below the regular addon panel"""
-    bl_label = "Addon registry"
-    bl_space_type = "USER_PREFERENCES"
-    bl_region_type = "WINDOW"
+def apply_addon_database(addons, registries_cache):
+    if addons is None and registries_cache == configuration["registries-cache"]:
+        return
+    configuration["registries-cache"] = registries_cache
+    if addons is not None:
+        configuration["addons"] = addons
+        sort_addonds()
+    save_database()
+
+def update_addon_database():
+    global lastError
+    
+    if not configuration["registries"]:
+        return False
+    
+    addons, registries_cache, error = fetch_addon_database()
+    if error != ERROR_NONE:
+        lastError = error
+    
+    apply_addon_database(addons, registries_cache)
+    return error == ERROR_NONE
+
+def is_updating_in_background():
+    return background_refresh_thread is not None and background_refresh_thread.is_alive()
+
+# the database is applied on the main thread by poll_background_refresh
+def update_addon_database_in_background():
+    global background_refresh_thread
+    
+    if not configuration["registries"] or is_updating_in_background():
+        return False
+    
+    def run():
+        try:
+            background_refresh_results.put(fetch_addon_database())
+        except:
+            background_refresh_results.put((None, configuration["registries-cache"], ERROR_FAILED_RETRIEVE_ADDON_LIST))
     
-    @classmethod
-    def poll(cls, context):
-        return (context.user_preferences.active_section == 'ADDONS')
+    background_refresh_thread = threading.Thread(target=run, name="addon_registry_refresh", daemon=True)
+    background_refresh_thread.start()
     
-    def draw(self, context):
-        layout = self.layout
+    if hasattr(bpy.app, "timers"):
+        bpy.app.timers.register(poll_background_refresh, first_interval=background_refresh_interval, persistent=True)
+    else:
+        bpy.app.handlers.scene_update_post.append(poll_background_refresh)
+    return True
+
+def poll_background_refresh(*args):
+    global lastError
+    
+    try:
+        addons, registries_cache, error = background_refresh_results.get_nowait()
+    except queue.Empty:
+        return background_refresh_interval
+    
+    if poll_background_refresh in getattr(bpy.app.handlers, "scene_update_post", []):
+        bpy.app.handlers.scene_update_post.remove(poll_background_refresh)
+    
+    if error != ERROR_NONE:
+        lastError = error
+    apply_addon_database(addons, registries_cache)
+    
+    redraw_user_preferences()
+    return None
+
+# Blender removes the handlers and timers which are not persistent when a file is loaded, e.g. the one given on the
+# command line just after the addons are registered, and the result of the refresh would never be applied
+if bpy is not None:
+    poll_background_refresh = bpy.app.handlers.persistent(poll_background_refresh)
+
+def redraw_user_preferences():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == AddonRegistryPanel.bl_space_type:
+                area.tag_redraw()
+
+# installs the locked addons, locked_addons maps the addon names to one of their hashes, or to None for the version of the
+# registry, and returns a report which can be dumped in JSON
+# Blender itself is not touched, the addons are loaded by the next Blender session
+def provision(locked_addons, update_database=True, force=False):
+    report = {"database": {"updated": False, "error": ERROR_NONE}, "addons": {}}
+    if update_database and configuration["registries"]:
+        addons, registries_cache, error = fetch_addon_database()
+        apply_addon_database(addons, registries_cache)
+        report["database"] = {"updated": addons is not None, "error": error}
+    ensure_database()
+    
+    installed = scan_installed_addons()
+    
+    addon_names = []
+    hash_keys = dict()
+    for addon_name, digest in sorted(locked_addons.items()):
+        addon = configuration["addons"].get(addon_name, None)
+        entry = {"hash": digest, "version": None, "status": "failed", "error": ERROR_NONE}
+        report["addons"][addon_name] = entry
         
-        if lastError != ERROR_NONE:
-            box = layout.box()
+        if addon is None:
+            entry["error"] = ERROR_NOT_IN_REGISTRY
+        elif digest and get_locked_hash_key(addon, digest) is None:
+            entry["error"] = ERROR_LOCK_MISMATCH
+        else:
+            # the download is verified against the locked hash, not the preferred one of the record
+            hash_keys[addon_name] = get_locked_hash_key(addon, digest) if digest else get_hash_key(addon)
+            entry["hash"] = hash_keys[addon_name]
+            entry["version"] = addon["info"]["version"]
+            if not force and addon_name in installed and addon_name not in get_updates_available():
+                entry["status"] = "up-to-date"
+            else:
+                addon_names.append(addon_name)
+    
+    if addon_names:
+        results, manual_downloads = execute_install_plan(plan_install(addon_names, installed, hash_keys))
+        update_installed_addons(addon_names)
+        for addon_name, error in results.items():
+            entry = report["addons"][addon_name]
+            entry["error"] = error
+            if error == ERROR_NONE:
+                entry["status"] = "installed"
+            if addon_name in manual_downloads:
+                entry["download"] = manual_downloads[addon_name]
+    
+    for entry in [report["database"]] + list(report["addons"].values()):
+        entry["message"] = error_titles[entry["error"]]
+    return report
+
+# command line, for instance:
+# python addon_registry.py addons.lock --scripts-dir ~/.config/blender/2.79/scripts
+# blender -b --python-expr "import sys, addon_registry; sys.exit(addon_registry.main())" -- addons.lock
+def main(argv=None):
+    global scripts_dir
+    
+    if argv is None:
+        argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    
+    parser = argparse.ArgumentParser(prog="addon_registry", description="Install the addons of a lockfile from the registries.")
+    parser.add_argument("lockfile", help="JSON object mapping the addon names to one of their hashes, or to null for the version of the registry")
+    parser.add_argument("--scripts-dir", help="Blender scripts directory, required outside of Blender")
+    parser.add_argument("--report", help="file to write the JSON report to, instead of the standard output")
+    parser.add_argument("--offline", action="store_true", help="use the last downloaded database instead of updating it")
+    parser.add_argument("--force", action="store_true", help="install the addons which are already up to date")
+    parser.add_argument("--metrics", help="file to write the timings of the operations to, as JSON lines")
+    args = parser.parse_args(argv)
+    
+    if args.scripts_dir:
+        scripts_dir = os.path.expanduser(args.scripts_dir)
+    elif bpy is None:
+        parser.error("--scripts-dir is required outside of Blender")
+    
+    with open(args.lockfile, 'r', encoding="utf-8") as f:
+        locked_addons = json.load(f)
+    
+    load_configuration()
+    report = provision(locked_addons, update_database=not args.offline, force=args.force)
+    
+    if args.metrics:
+        export_metrics(os.path.abspath(args.metrics))
+    
+    content = json.dumps(report, indent=4, sort_keys=True)
+    if args.report:
+        write_file_atomically(os.path.abspath(args.report), content)
+    else:
+        print(content)
+    
+    failed = report["database"]["error"] != ERROR_NONE or any(entry["status"] == "failed" for entry in report["addons"].values())
+    return 1 if failed else 0
+
+# the user interface, only defined inside Blender
+if bpy is not None:
+    class AddonRegistryPanel(Panel):
+        """Addon registry panel, below the regular addon panel"""
+        bl_label = "Addon registry"
+        bl_space_type = "USER_PREFERENCES"
+        bl_region_type = "WINDOW"
+        
+        @classmethod
+        def poll(cls, context):
+            return (context.user_preferences.active_section == 'ADDONS')
+        
+        def draw(self, context):
+            metric = start_metric()
+            layout = self.layout
             
-            box.label(icon='ERROR', text=error_titles[lastError])
+            if lastError != ERROR_NONE:
+                box = layout.box()
+                
+                box.label(icon='ERROR', text=error_titles[lastError])
+                
+                if lastError == ERROR_EXTRACT_MANUALLY:
+                    box.label("The downloaded file is not recognized. It should be an archive that you need to extract manually.")
+                    split = box.split(0.6)
+                    split.label("By installing 7-Zip and adding it to your PATH, the registry recognizes more formats.")
+                    row = split.row()
+                    row.operator("wm.url_open", icon='URL', text="Download 7-Zip").url = "http://www.7-zip.org/download.html"
+                    row.operator("wm.url_open", icon='URL', text="Installation instructions").url = "http://www.7-zip.org/download.html"
+                
+                elif lastError == ERROR_FAILED_COPY:
+                    box.label("The addon file is unreachable.")
+                
+                elif lastError == ERROR_FAILED_DOWNLOAD:
+                    box.label("Something may be wrong with your Internet connection. Please try again later.")
+                
+                elif lastError == ERROR_FAILED_REQUEST:
+                    box.label("The server hosting the addon may be down. Please try again later.")
+                    box.label("The addon may have moved to another URL. If you think this is the case, please report it using the following button, so that the maintainer will update the registry.")
+                
+                elif lastError == ERROR_FAILED_RETRIEVE_ADDON_LIST:
+                    box.label("The registry server may be down. Please try again later.")
+                    box.label("The registry may have moved to another URL. If you think this is the case, please report it using the following button, so that the maintainer will update the registry.")
+                
+                elif lastError == ERROR_HASH_MISMATCH:
+                    box.label("The downloaded addon does not match the registry record. For security reasons, it won't be installed.")
+                    box.label("It could mean that the addon's author has uploaded a new version with the same URL.")
+                    box.label("If you think this is the case, please report it using the following button, so that the maintainer will update the registry.")
+                
+                elif lastError == ERROR_NO_HASH:
+                    box.label("The registry record does not contain an expected hash, therefore the addon authenticity can't be verified.")
+                    box.label("You may be using an unofficial registry. If this is the case, please report it to its maintainers.")
+                
+                split = box.split(0.9)
+                split.operator("wm.url_open", icon='URL', text="If the error persists, please report an issue to the registry maintainers").url = "https://github.com/Bloutiouf/XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX/issues/new"
+                split.operator("addon_registry.hide_error", icon='X')
             
-            if lastError == ERROR_EXTRACT_MANUALLY:
-                box.label("The downloaded file is not recognized. It should be an archive that you need to extract manually.")
-                split = box.split(0.6)
-                split.label("By installing 7-Zip and adding it to your PATH, the registry recognizes more formats.")
-                row = split.row()
-                row.operator("wm.url_open", icon='URL', text="Download 7-Zip").url = "http://www.7-zip.org/download.html"
-                row.operator("wm.url_open", icon='URL', text="Installation instructions").url = "http://www.7-zip.org/download.html"
+            addon_dir = get_addon_dir()
             
-            elif lastError == ERROR_FAILED_COPY:
-                box.label("The addon file is unreachable.")
+            userpref = context.user_preferences
+            wm = context.window_manager
             
-            elif lastError == ERROR_FAILED_DOWNLOAD:
-                box.label("Something may be wrong with your Internet connection. Please try again later.")
+            enabled_addon_names = {addon.module for addon in userpref.addons}
             
-            elif lastError == ERROR_FAILED_REQUEST:
-                box.label("The server hosting the addon may be down. Please try again later.")
-                box.label("The addon may have moved to another URL. If you think this is the case, please report it using the following button, so that the maintainer will update the registry.")
+            split = layout.split(percentage=0.2)
             
-            elif lastError == ERROR_FAILED_RETRIEVE_ADDON_LIST:
-                box.label("The registry server may be down. Please try again later.")
-                box.label("The registry may have moved to another URL. If you think this is the case, please report it using the following button, so that the maintainer will update the registry.")
+            col = split.column()
             
-            elif lastError == ERROR_HASH_MISMATCH:
-                box.label("The downloaded addon does not match the registry record. For security reasons, it won't be installed.")
-                box.label("It could mean that the addon's author has uploaded a new version with the same URL.")
-                box.label("If you think this is the case, please report it using the following button, so that the maintainer will update the registry.")
+            col.operator(UpdateDatabase.bl_idname, icon='FILE_REFRESH')
+            if is_updating_in_background():
+                col.label(text="Updating...", icon='TIME')
+            col.separator()
             
-            elif lastError == ERROR_NO_HASH:
-                box.label("The registry record does not contain an expected hash, therefore the addon authenticity can't be verified.")
-                box.label("You may be using an unofficial registry. If this is the case, please report it to its maintainers.")
+            col.prop(wm, "addon_registry_search", text="", icon='VIEWZOOM')
             
-            split = box.split(0.9)
-            split.operator("wm.url_open", icon='URL', text="If the error persists, please report an issue to the registry maintainers").url = "https://github.com/Bloutiouf/XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX/issues/new"
-            split.operator("addon_registry.hide_error", icon='X')
-        
-        addon_dir = get_addon_dir()
-        
-        userpref = context.user_preferences
-        wm = context.window_manager
-        
-        installed_addons = {}
-        for mod in addon_utils.modules(refresh=False):
-            installed_addons[mod.__name__] = mod
-        
-        enabled_addon_names = {addon.module for addon in userpref.addons}
-        
-        split = layout.split(percentage=0.2)
-        
-        col = split.column()
-        
-        col.operator(UpdateDatabase.bl_idname, icon='FILE_REFRESH')
-        col.separator()
-        
-        col.prop(wm, "addon_registry_search", text="", icon='VIEWZOOM')
-        
-        col.label(text="Categories")
-        col.prop(wm, "addon_registry_filter", expand=True)
-        
-        col.separator()
-        col.operator(ResetConfiguration.bl_idname, icon='CANCEL')
-        
-        col = split.column()
-        
-        filter = wm.addon_registry_filter
-        search = wm.addon_registry_search.lower()
-        
-        for name, addon in sorted_addons:
-            info = addon["info"]
-            available_version = info["version"]
-            show_expanded = addon.get("show_expanded", False)
+            col.label(text="Categories")
+            col.prop(wm, "addon_registry_filter", expand=True)
             
-            installed_addon = installed_addons.get(name, None)
-            installed_version = None
-            is_installed = bool(installed_addon)
-            is_newer_available = False
-            is_enabled = False
-            if is_installed:
-                installed_info = addon_utils.module_bl_info(installed_addon)
-                installed_version = list(installed_info["version"])
-                is_newer_available = is_newer_version(available_version, installed_version)
-                is_enabled = name in enabled_addon_names
+            col.separator()
+            col.operator(ResetConfiguration.bl_idname, icon='CANCEL')
+            col.prop(wm, "addon_registry_show_metrics")
             
-            if ((filter == "All") or
-                (filter == "New Version Available" and is_newer_available) or
-                (filter == info["category"]) or
-                (filter == "Installed" and is_installed) or
-                (filter == "Not Installed" and not is_installed)
-                ):
-                if search and search not in info["name"].lower():
-                    if info["author"]:
-                        if search not in info["author"].lower():
-                            continue
-                    else:
-                        continue
+            col = split.column()
+            
+            filter = wm.addon_registry_filter
+            search = wm.addon_registry_search.lower()
+            
+            view_rows = get_view_rows(filter, search)
+            page_size = max(configuration["page-size"], 1)
+            page_count = max((len(view_rows) + page_size - 1) // page_size, 1)
+            page = min(wm.addon_registry_page, page_count - 1)
+            
+            if page_count > 1:
+                row = col.row()
+                sub = row.row()
+                sub.enabled = page > 0
+                sub.operator(ChangePage.bl_idname, icon='TRIA_LEFT', text="Previous").page = page - 1
+                row.label(text="Page %d / %d (%d addons)" % (page + 1, page_count, len(view_rows)))
+                sub = row.row()
+                sub.enabled = page < page_count - 1
+                sub.operator(ChangePage.bl_idname, icon='TRIA_RIGHT', text="Next").page = page + 1
+            
+            for view_row in view_rows[page * page_size:(page + 1) * page_size]:
+                name = view_row["name"]
+                addon = view_row["addon"]
+                info = addon["info"]
+                available_version = info["version"]
+                show_expanded = name in expanded_addons
+                
+                installed_version = view_row["installed_version"]
+                is_installed = view_row["is_installed"]
+                is_newer_available = view_row["is_newer_available"]
+                is_enabled = is_installed and name in enabled_addon_names
                 
                 peers = addon.get("peers", None)
                 if peers and (type(peers) is not list or len(peers) == 0):
@@ -454,214 +2407,267 @@ class AddonRegistryPanel(Panel):
                         separators -= 1
                     for i in range(separators):
                         split.separator()
+            
+            if wm.addon_registry_show_metrics:
+                box = layout.box()
+                row = box.row()
+                if last_draw_duration is None:
+                    row.label(text="Timings")
+                else:
+                    row.label(text="Timings, last draw %.1f ms" % (last_draw_duration * 1000))
+                row.operator(ExportMetrics.bl_idname, icon='EXPORT')
+                
+                with metrics_lock:
+                    records = list(metrics)[-20:]
+                for record in reversed(records):
+                    box.label(text=format_metric(record), icon='ERROR' if record.get("error", ERROR_NONE) != ERROR_NONE else 'TIME')
+            
+            finish_draw_metric(metric)
 
 
-class Expand(Operator):
-    """Display more information on this addon"""
-    bl_idname = "addon_registry.addon_expand"
-    bl_label = ""
-    
-    addon_name = StringProperty(
-        name="Addon name"
-        )
-    
-    def execute(self, context):
-        try:
-            addon = configuration["addons"][self.addon_name]
-        except:
-            self.report({"ERROR"}, "Addon is not in the registry.")
-            return {"CANCELLED"}
+    class Expand(Operator):
+        """Display more information on this addon"""
+        bl_idname = "addon_registry.addon_expand"
+        bl_label = ""
+        
+        addon_name = StringProperty(
+            name="Addon name"
+            )
         
-        addon["show_expanded"] = not addon.get("show_expanded", False)
-        return {"FINISHED"}
+        def execute(self, context):
+            ensure_database()
+            if self.addon_name not in configuration["addons"]:
+                self.report({"ERROR"}, "Addon is not in the registry.")
+                return {"CANCELLED"}
+            
+            if self.addon_name in expanded_addons:
+                expanded_addons.remove(self.addon_name)
+            else:
+                expanded_addons.add(self.addon_name)
+            return {"FINISHED"}
 
 
-class Install(Operator):
-    """Install the latest version"""
-    bl_idname = "addon_registry.install"
-    bl_label = "Version"
-    
-    addon_name = StringProperty(
-        name="Addon name"
-        )
-    
-    def execute(self, context):
-        global lastError
-        
-        addon_name = str(self.addon_name)
-        lastError = install(addon_name)
+    class Install(Operator):
+        """Install the latest version"""
+        bl_idname = "addon_registry.install"
+        bl_label = "Version"
         
-        if lastError == ERROR_EXTRACT_MANUALLY:
-            return {"RUNNING_MODAL"}
+        addon_name = StringProperty(
+            name="Addon name"
+            )
         
-        if lastError != ERROR_NONE:
-            self.report({'ERROR'}, error_titles[lastError])
-            return {'CANCELLED'}
+        def execute(self, context):
+            global lastError
+            
+            addon_name = str(self.addon_name)
+            lastError = install(addon_name)
+            
+            if lastError == ERROR_EXTRACT_MANUALLY:
+                return {"RUNNING_MODAL"}
+            
+            if lastError != ERROR_NONE:
+                self.report({'ERROR'}, error_titles[lastError])
+                return {'CANCELLED'}
+            
+            refresh_installed_addons(context, [addon_name])
+            
+            return {'FINISHED'}
+
+    class ChangePage(Operator):
+        """Show another page of addons"""
+        bl_idname = "addon_registry.change_page"
+        bl_label = ""
         
-        addon_utils.modules(refresh=True)
-        bpy.utils.refresh_script_paths()
-        bpy.ops.script.reload()
+        page = IntProperty(
+            name="Page"
+            )
         
-        return {'FINISHED'}
-
-class HideError(Operator):
-    """Hide error"""
-    bl_idname = "addon_registry.hide_error"
-    bl_label = "Got it"
-    
-    def execute(self, context):
-        global lastError
-        lastError = ERROR_NONE
-        return {"FINISHED"}
+        def execute(self, context):
+            context.window_manager.addon_registry_page = max(self.page, 0)
+            return {"FINISHED"}
 
+    class ExportMetrics(Operator):
+        """Export the latest timings of the registry operations as JSON lines"""
+        bl_idname = "addon_registry.export_metrics"
+        bl_label = "Export timings"
+        
+        filepath = StringProperty(
+                subtype="FILE_PATH"
+                )
+        
+        def execute(self, context):
+            export_metrics(self.filepath)
+            return {"FINISHED"}
+        
+        def invoke(self, context, event):
+            if not self.filepath:
+                self.filepath = "addon_registry_metrics.jsonl"
+            context.window_manager.fileselect_add(self)
+            return {"RUNNING_MODAL"}
 
-class ResetConfiguration(Operator):
-    """Reset configuration to the default values"""
-    bl_idname = "addon_registry.reset_configuration"
-    bl_label = "Reset configuration"
-    
-    def execute(self, context):
-        global configuration
-        configuration = copy.deepcopy(default_configuration)
-        save_configuration()
-        return {"FINISHED"}
-    
-    def draw(self, context):
-        self.layout.label(text="Are you sure?")
-    
-    def invoke(self, context, event):
-        return context.window_manager.invoke_props_dialog(self)
+    class HideError(Operator):
+        """Hide error"""
+        bl_idname = "addon_registry.hide_error"
+        bl_label = "Got it"
+        
+        def execute(self, context):
+            global lastError
+            lastError = ERROR_NONE
+            return {"FINISHED"}
 
 
-class SaveArchive(Operator):
-    """Manually download the addon"""
-    bl_idname = "addon_registry.save_archive"
-    bl_label = "Save archive"
+    class ResetConfiguration(Operator):
+        """Reset configuration to the default values"""
+        bl_idname = "addon_registry.reset_configuration"
+        bl_label = "Reset configuration"
+        
+        def execute(self, context):
+            global configuration, database_loaded
+            configuration = copy.deepcopy(default_configuration)
+            database_loaded = True
+            sort_addonds()
+            save_configuration()
+            save_database()
+            return {"FINISHED"}
+        
+        def draw(self, context):
+            self.layout.label(text="Are you sure?")
+        
+        def invoke(self, context, event):
+            return context.window_manager.invoke_props_dialog(self)
 
-    download_path = StringProperty(
-            name="Download path",
-            options={"HIDDEN"}
-            )
 
-    filepath = StringProperty(
-            subtype="FILE_PATH"
-            )
+    class SaveArchive(Operator):
+        """Manually download the addon"""
+        bl_idname = "addon_registry.save_archive"
+        bl_label = "Save archive"
 
-    def execute(self, context):
-        os.rename(self.download_path, self.filepath)
-        return {"FINISHED"}
+        download_path = StringProperty(
+                name="Download path",
+                options={"HIDDEN"}
+                )
 
-    def invoke(self, context, event):
-        wm = context.window_manager
-        wm.fileselect_add(self)
-        return {"RUNNING_MODAL"}
-        return context.window_manager.invoke_props_dialog(self, width=600)
+        filepath = StringProperty(
+                subtype="FILE_PATH"
+                )
 
+        def execute(self, context):
+            shutil.move(self.download_path, self.filepath)
+            return {"FINISHED"}
 
-class UpdateDatabase(Operator):
-    """Update addon database"""
-    bl_idname = "addon_registry.update_database"
-    bl_label = "Update addon database"
-    
-    def execute(self, context):
-        global lastError
-        
-        if not update_addon_database():
-            self.report({"ERROR"}, error_titles[lastError])
-            return {"CANCELLED"}
-        
-        lastError = ERROR_NONE
-        return {"FINISHED"}
+        def invoke(self, context, event):
+            wm = context.window_manager
+            wm.fileselect_add(self)
+            return {"RUNNING_MODAL"}
+            return context.window_manager.invoke_props_dialog(self, width=600)
 
 
-class UpdateAll(Operator):
-    """Update installed addons that have a newer version on the registry"""
-    bl_idname = "addon_registry.update_all"
-    bl_label = "Update addons from registry"
-    
-    def execute(self, context):
-        global lastError
-        
-        bpy.ops.addon_registry.update_database()
+    class UpdateDatabase(Operator):
+        """Update addon database"""
+        bl_idname = "addon_registry.update_database"
+        bl_label = "Update addon database"
         
-        installed_addons = {}
-        for mod in addon_utils.modules(refresh=False):
-            installed_addons[mod.__name__] = mod
+        def execute(self, context):
+            global lastError
+            
+            if not update_addon_database():
+                self.report({"ERROR"}, error_titles[lastError])
+                return {"CANCELLED"}
+            
+            lastError = ERROR_NONE
+            return {"FINISHED"}
 
-        for name, addon in configuration["addons"].items():
-            info = addon["info"]
-            available_version = info["version"]
 
-            installed_addon = installed_addons.get(name, None)
-            is_installed = bool(installed_addon)
-            if is_installed:
-                installed_info = addon_utils.module_bl_info(installed_addon)
-                installed_version = list(installed_info["version"])
-                is_newer_available = is_newer_version(available_version, installed_version)
-                
-                if is_newer_available:
-                    lastError = install(name)
-                    
-                    if lastError == ERROR_EXTRACT_MANUALLY:
-                        return {"RUNNING_MODAL"}
-                    
-                    if lastError != ERROR_NONE:
-                        self.report({'ERROR'}, error_titles[lastError])
-                        return {'CANCELLED'}
-                    
-        addon_utils.modules(refresh=True)
-        bpy.utils.refresh_script_paths()
-        bpy.ops.script.reload()
+    class UpdateAll(Operator):
+        """Update installed addons that have a newer version on the registry"""
+        bl_idname = "addon_registry.update_all"
+        bl_label = "Update addons from registry"
         
-        return {"FINISHED"}
-
-
-def update_from_registry(self, context):
-    if context.user_preferences.active_section == "ADDONS":
-        self.layout.operator(UpdateAll.bl_idname, icon='FILE_REFRESH')
-
-def register():
-    def addon_filter_items(self, context):
-        import addon_utils
-
-        items = [
-            ("All", "All", "All Addons"),
-            ("New Version Available", "New Version Available", "All New Version Available Addons"),
-            ("Installed", "Installed", "All Installed Addons"),
-            ("Not Installed", "Not Installed", "All Not Installed Addons")
-        ]
+        def execute(self, context):
+            global lastError
+            
+            bpy.ops.addon_registry.update_database()
+            
+            # the addons may have been changed from elsewhere since the last scan
+            scan_installed_addons()
+            results = install_many(sorted(get_updates_available()))
+            
+            failures = sorted((name, error) for name, error in results.items() if error != ERROR_NONE)
+            for name, error in failures:
+                self.report({'WARNING'}, "%s: %s" % (name, error_titles[error]))
+            
+            if failures:
+                lastError = failures[0][1]
+                self.report({'ERROR'}, "Failed to update %d of %d addons." % (len(failures), len(results)))
+            
+            if len(failures) < len(results):
+                refresh_installed_addons(context, [name for name, error in results.items() if error == ERROR_NONE])
+            
+            return {"FINISHED"}
 
-        items_unique = set()
 
-        for mod in addon_utils.modules(refresh=False):
-            info = addon_utils.module_bl_info(mod)
-            items_unique.add(info["category"])
+    def update_from_registry(self, context):
+        if context.user_preferences.active_section == "ADDONS":
+            update_count = len(get_updates_available())
+            if update_count:
+                self.layout.operator(UpdateAll.bl_idname, icon='FILE_REFRESH', text="%s (%d)" % (UpdateAll.bl_label, update_count))
+            else:
+                self.layout.operator(UpdateAll.bl_idname, icon='FILE_REFRESH')
 
-        items.extend([(cat, cat, "") for cat in sorted(items_unique)])
-        return items
+    def register():
+        def addon_filter_items(self, context):
+            # the list is kept alive by the index, as Blender does not keep a reference to it
+            return get_search_index()["filter_items"]
 
-    bpy.utils.register_module(__name__)
-    USERPREF_HT_header.append(update_from_registry)
-    
-    WindowManager.addon_registry_search = StringProperty(
-            name="Search",
-            description="Search within the selected filter",
+        bpy.utils.register_module(__name__)
+        USERPREF_HT_header.append(update_from_registry)
+        
+        def reset_page(self, context):
+            self.addon_registry_page = 0
+        
+        WindowManager.addon_registry_search = StringProperty(
+                name="Search",
+                description="Search within the selected filter",
+                update=reset_page
+                )
+        
+        WindowManager.addon_registry_filter = EnumProperty(
+            name="Category",
+            description="Filter addons by category",
+            items=addon_filter_items,
+            update=reset_page
             )
-    
-    WindowManager.addon_registry_filter = EnumProperty(
-        name="Category",
-        description="Filter addons by category",
-        items=addon_filter_items
-        )
-    
-    load_configuration()
-    update_addon_database()
+        
+        WindowManager.addon_registry_page = IntProperty(
+            name="Page",
+            description="Page of the addon list",
+            min=0
+            )
+        
+        WindowManager.addon_registry_show_metrics = BoolProperty(
+            name="Show timings",
+            description="Show the timings of the latest registry operations"
+            )
+        
+        load_configuration()
+        if configuration["background-refresh"]:
+            update_addon_database_in_background()
+        else:
+            update_addon_database()
 
-def unregister():
-    USERPREF_HT_header.remove(update_from_registry)
-    bpy.utils.unregister_module(__name__)
-    del WindowManager.addon_registry_search
-    del WindowManager.addon_registry_filter
+    def unregister():
+        if poll_background_refresh in getattr(bpy.app.handlers, "scene_update_post", []):
+            bpy.app.handlers.scene_update_post.remove(poll_background_refresh)
+        if hasattr(bpy.app, "timers") and bpy.app.timers.is_registered(poll_background_refresh):
+            bpy.app.timers.unregister(poll_background_refresh)
+        USERPREF_HT_header.remove(update_from_registry)
+        bpy.utils.unregister_module(__name__)
+        del WindowManager.addon_registry_search
+        del WindowManager.addon_registry_filter
+        del WindowManager.addon_registry_page
+        del WindowManager.addon_registry_show_metrics
 
 if __name__ == "__main__":
+    if bpy is None:
+        sys.exit(main())
     register()
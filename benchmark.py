@@ -0,0 +1,241 @@
+# Benchmarks of the addon registry, run outside of Blender and without network access:
+# python benchmark.py [--sizes 100,10000,100000] [--repeat 5] [--json results.json]
+# The registries are generated following the schema of addons.json, and are read from local files or from a local
+# HTTP server.
+
+import addon_registry as registry
+import argparse
+import copy
+import hashlib
+import http.server
+import io
+import json
+import os
+import random
+import shutil
+import socketserver
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from urllib.parse import unquote, urlparse
+
+words = "mesh curve rig armature animation node render paint uv import export tool light camera bake sculpt texture material modifier physics".split()
+
+categories = ["3D View", "Add Curve", "Add Mesh", "Animation", "Import-Export", "Material", "Mesh", "Node", "Object", "Render", "Rigging", "System", "UV"]
+
+# search strings typed in the panel, with the filter selected at the same time
+searches = [("All", "mesh"), ("All", "rig"), ("Mesh", "uv"), ("Installed", ""), ("Not Installed", "bake"), ("All", "nothing matches")]
+
+# name, size, number of files, single file
+payloads = [
+    ("file_10k", 10240, 1, True),
+    ("file_1m", 1048576, 1, True),
+    ("zip_1m", 1048576, 16, False),
+    ("zip_16m", 16777216, 256, False),
+]
+
+def generate_addons(count, seed=0):
+    rng = random.Random(seed)
+    addons = dict()
+    for i in range(count):
+        name = "benchmark_%d" % i
+        addons[name] = {
+            "info": {
+                "author": "Author %d" % (i % 300),
+                "blender": [2, 70, 0],
+                "category": rng.choice(categories),
+                "description": " ".join(rng.sample(words, 8)).capitalize() + ".",
+                "location": "View3D > Tools",
+                "name": " ".join(rng.sample(words, 3)).title() + " %d" % i,
+                "version": [1, i % 10, 0],
+                "warning": "",
+                "wiki_url": "http://example.com/wiki/%d" % i,
+            },
+            "url": "http://example.com/%s.py" % name,
+            "sha256": hashlib.sha256(name.encode("utf-8")).hexdigest(),
+            "file": True,
+        }
+    return addons
+
+# half random, half repeated, so that the archives are somewhat compressible
+def generate_content(size, rng):
+    random_size = size // 2
+    return bytes(rng.getrandbits(8) for _ in range(random_size)) + b"#" * (size - random_size)
+
+def generate_payload(directory, name, size, file_count, is_file, rng):
+    bl_info = ("bl_info = {'name': %r, 'category': 'System', 'version': (1, 0, 0)}\n" % name).encode("utf-8")
+    if is_file:
+        content = bl_info + b"#" * (size - len(bl_info))
+        path = os.path.join(directory, name + ".py")
+    else:
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr(name + "/__init__.py", bl_info)
+            zf.writestr("README.md", b"benchmark")
+            for i in range(file_count):
+                zf.writestr("%s/data/%d.bin" % (name, i), generate_content(size // file_count, rng))
+        content = buffer.getvalue()
+        path = os.path.join(directory, name + ".zip")
+
+    with open(path, 'wb') as f:
+        f.write(content)
+    return path, hashlib.sha256(content).hexdigest()
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def translate_path(self, path):
+        return os.path.join(self.server.directory, unquote(urlparse(path).path).lstrip("/"))
+
+    def log_message(self, format, *args):
+        pass
+
+class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+def start_server(directory):
+    server = Server(("127.0.0.1", 0), QuietHandler)
+    server.directory = directory
+    thread = threading.Thread(target=server.serve_forever, name="benchmark_server", daemon=True)
+    thread.start()
+    return server, "http://127.0.0.1:%d/" % server.server_address[1]
+
+# the state of the addon is reset as if Blender had just started
+def reset_registry(scripts_dir, registries):
+    shutil.rmtree(scripts_dir, ignore_errors=True)
+    os.makedirs(os.path.join(scripts_dir, "addons"))
+    registry.scripts_dir = scripts_dir
+    registry.configuration.clear()
+    registry.configuration.update(copy.deepcopy(registry.default_configuration))
+    registry.configuration["registries"] = registries
+    registry.database_loaded = True
+    registry.installed_addons_dirs = None
+    registry.installed_addons_scanned.clear()
+    registry.invalidate_view_model()
+    registry.lastError = registry.ERROR_NONE
+
+def measure(results, name, size, function, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+
+    result = {"name": name, "size": size, "min": min(timings), "median": statistics.median(timings), "max": max(timings)}
+    results.append(result)
+    print("%-48s %8s %10.2f %10.2f %10.2f" % (name, size if size is not None else "", result["min"], result["median"], result["max"]))
+    sys.stdout.flush()
+
+def check(condition, message):
+    if not condition:
+        raise RuntimeError(message)
+
+def benchmark_database(results, work_dir, base_url, size, repeat):
+    registry_name = "registry_%d.json" % size
+    registry_path = os.path.join(work_dir, registry_name)
+    with open(registry_path, 'w', encoding="utf-8") as f:
+        json.dump(generate_addons(size), f)
+
+    scripts_dir = os.path.join(work_dir, "scripts")
+
+    def update_database():
+        check(registry.update_addon_database(), "update_addon_database failed: %s" % registry.error_titles[registry.lastError])
+
+    def forget_database():
+        registry.configuration["registries-cache"] = {}
+        registry.configuration["addons"] = {}
+        registry.sort_addonds()
+
+    reset_registry(scripts_dir, [{"url": registry_path}])
+    measure(results, "update_addon_database (file)", size, update_database, repeat, forget_database)
+
+    reset_registry(scripts_dir, [{"url": base_url + registry_name}])
+    measure(results, "update_addon_database (http)", size, update_database, repeat, forget_database)
+    measure(results, "update_addon_database (http, unchanged)", size, update_database, repeat)
+
+    measure(results, "sort_addonds", size, registry.sort_addonds, repeat)
+
+    measure(results, "save_configuration", size, registry.save_configuration, repeat)
+    measure(results, "load_configuration", size, registry.load_configuration, repeat)
+
+    measure(results, "save_database", size, registry.save_database, repeat)
+
+    def unload_database():
+        registry.database_loaded = False
+
+    measure(results, "ensure_database", size, registry.ensure_database, repeat, unload_database)
+
+    # the logic behind AddonRegistryPanel.draw
+    def invalidate_database():
+        registry.database_revision += 1
+
+    measure(results, "first draw (view model, search index)", size, lambda: registry.get_view_rows("All", ""), repeat, invalidate_database)
+
+    def invalidate_filter():
+        registry.filtered_rows_key = None
+
+    def search():
+        for filter, text in searches:
+            invalidate_filter()
+            registry.get_view_rows(filter, text)
+
+    measure(results, "filter and search (%d queries)" % len(searches), size, search, repeat)
+
+def benchmark_install(results, work_dir, base_url, repeat):
+    rng = random.Random(0)
+    payload_dir = os.path.join(work_dir, "payloads")
+    os.makedirs(payload_dir)
+
+    addons = dict()
+    for name, size, file_count, is_file in payloads:
+        path, sha256 = generate_payload(payload_dir, name, size, file_count, is_file, rng)
+        addons[name] = {
+            "info": {"name": name, "category": "System", "version": [1, 0, 0], "author": "", "description": "", "location": "", "wiki_url": ""},
+            "url": base_url + "payloads/" + os.path.basename(path),
+            "sha256": sha256,
+        }
+        if is_file:
+            addons[name]["file"] = True
+
+    scripts_dir = os.path.join(work_dir, "scripts")
+    reset_registry(scripts_dir, [])
+    registry.configuration["addons"] = addons
+    registry.configuration["download-cache-size"] = 0
+    registry.sort_addonds()
+
+    for name, size, file_count, is_file in payloads:
+        def install():
+            error = registry.install(name)
+            check(error == registry.ERROR_NONE, "install %s failed: %s" % (name, registry.error_titles[error]))
+
+        measure(results, "install %s" % name, size, install, repeat)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the addon registry outside of Blender.")
+    parser.add_argument("--sizes", default="100,10000,100000", help="comma separated numbers of addons in the generated registries")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs of each benchmark")
+    parser.add_argument("--json", help="file to write the results to")
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix="addon_registry_benchmark-")
+    server, base_url = start_server(work_dir)
+    results = []
+    try:
+        print("%-48s %8s %10s %10s %10s" % ("benchmark", "size", "min ms", "median ms", "max ms"))
+        for size in [int(size) for size in args.sizes.split(",") if size]:
+            benchmark_database(results, work_dir, base_url, size, args.repeat)
+        benchmark_install(results, work_dir, base_url, args.repeat)
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding="utf-8") as f:
+            json.dump({"python": sys.version, "repeat": args.repeat, "results": results}, f, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -29,12 +29,22 @@ var async = require('async'),
 	merge = require('merge'),
 	path = require('path'),
 	request = require('request'),
-	rimraf = require('rimraf');
+	rimraf = require('rimraf'),
+	spawn = require('child_process').spawn;
 
 var defaultOptions = {
-	hash: 'sha256'
+	concurrency: 8,
+	hash: 'sha256',
+	keepDeltas: 100
 };
 
+var manifestFile = 'addons.manifest.json',
+	deltasDir = 'addons.deltas',
+	sourcesFile = 'addons.sources.json';
+
+// the bl_info worker exits after being idle for this long, in milliseconds
+var workerIdleTimeout = 1000;
+
 function bareName(file) {
 	return path.basename(file, path.extname(file));
 }
@@ -47,189 +57,620 @@ try {
 
 exports.addons = addons;
 
-function saveAddons(callback) {
-	return fs.writeFile('addons.json', JSON.stringify(addons, null, '\t'), callback);
+// writes to a temporary file renamed over the destination, so that readers never see a partial file
+function writeFileAtomically(file, content, callback) {
+	var tmpFile = file + '.' + process.pid + '.tmp';
+	return fs.writeFile(tmpFile, content, function(err) {
+		if (err) {
+			return callback(err);
+		}
+		return fs.rename(tmpFile, file, callback);
+	});
 }
 
-function extractBlInfo(content, callback) {
-	var match = /bl_info\s*=\s*\{[^]*?\}/.exec(content.toString());
-	if (!match) {
-		return callback(new Error('bl_info missing.'));
+// changes since the last save, written as the next delta
+var pendingDelta = {
+	changed: {},
+	removed: {}
+};
+
+function recordChange(name, addon) {
+	if (addon && addons.hasOwnProperty(name) && JSON.stringify(addons[name]) === JSON.stringify(addon)) {
+		return;
 	}
 	
-	var python = execFile('python', function(err, stdout, stderr) {
+	if (addon) {
+		pendingDelta.changed[name] = addon;
+		delete pendingDelta.removed[name];
+	} else {
+		delete pendingDelta.changed[name];
+		pendingDelta.removed[name] = true;
+	}
+}
+
+function readManifest() {
+	try {
+		return JSON.parse(fs.readFileSync(manifestFile));
+	} catch (err) {
+		return {
+			revision: 0,
+			'oldest-revision': 1,
+			deltas: deltasDir + '/'
+		};
+	}
+}
+
+// writes addons.json, then the delta of the pending changes, then the manifest pointing to it
+function writeAddons(options, callback) {
+	var delta = {
+		changed: pendingDelta.changed,
+		removed: Object.keys(pendingDelta.removed)
+	};
+	pendingDelta = {
+		changed: {},
+		removed: {}
+	};
+	
+	var content = (options.compact ? JSON.stringify(addons) : JSON.stringify(addons, null, '\t'));
+	return writeFileAtomically('addons.json', content, function(err) {
 		if (err) {
 			return callback(err);
 		}
-		return callback(null, JSON.parse(stdout));
+		
+		if (!Object.keys(delta.changed).length && !delta.removed.length) {
+			return callback();
+		}
+		
+		var manifest = readManifest();
+		manifest.revision += 1;
+		delta.revision = manifest.revision;
+		
+		var keepDeltas = options.keepDeltas || options['keep-deltas'] || defaultOptions.keepDeltas;
+		var oldestRevision = Math.max(manifest['oldest-revision'], manifest.revision - keepDeltas + 1);
+		var expiredRevisions = [];
+		for (var revision = manifest['oldest-revision']; revision < oldestRevision; ++revision) {
+			expiredRevisions.push(revision);
+		}
+		manifest['oldest-revision'] = oldestRevision;
+		
+		return async.series([
+			function(callback) {
+				return fs.mkdir(deltasDir, function(err) {
+					return callback(err && err.code !== 'EEXIST' ? err : null);
+				});
+			},
+			function(callback) {
+				return fs.writeFile(path.join(deltasDir, delta.revision + '.json'), JSON.stringify(delta), callback);
+			},
+			function(callback) {
+				return writeFileAtomically(manifestFile, JSON.stringify(manifest, null, '\t'), callback);
+			},
+			function(callback) {
+				return async.each(expiredRevisions, function(revision, callback) {
+					return fs.unlink(path.join(deltasDir, revision + '.json'), function() {
+						return callback();
+					});
+				}, callback);
+			}
+		], function(err) {
+			return callback(err);
+		});
 	});
-	
-	python.stdin.write(match[0]);
-	python.stdin.write('\nimport json\nprint(json.dumps(bl_info, separators=(",", ":")))');
-	return python.stdin.end();
 }
 
-exports.add = function(url, options, callback) {
-	if (!callback) {
-		callback = options;
-		options = {};
+// saves are serialized, so that concurrent adds do not publish the same revision
+var saveQueue = async.queue(writeAddons, 1);
+
+function saveAddons(options, callback) {
+	return saveQueue.push(options, callback);
+}
+
+// python script reading requests {id, source} as JSON lines on stdin, and answering {id, info} or {id, error}
+// bl_info is found with ast and evaluated with ast.literal_eval, the regex is only a fallback for the files which do
+// not parse with this version of Python
+var blInfoScript = [
+	'import ast, json, re, sys',
+	'def extract(source):',
+	'    try:',
+	'        nodes = ast.parse(source).body',
+	'    except SyntaxError:',
+	'        match = re.search(r"bl_info\\s*=\\s*(\\{.*?\\})", source, re.S)',
+	'        if not match:',
+	'            raise ValueError("bl_info missing.")',
+	'        return ast.literal_eval(match.group(1))',
+	'    for node in nodes:',
+	'        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "bl_info" for target in node.targets):',
+	'            return ast.literal_eval(node.value)',
+	'    raise ValueError("bl_info missing.")',
+	'stdin = getattr(sys.stdin, "buffer", sys.stdin)',
+	'for line in iter(stdin.readline, b""):',
+	'    request = json.loads(line.decode("utf-8"))',
+	'    try:',
+	'        response = json.dumps({"id": request["id"], "info": extract(request["source"])}, separators=(",", ":"))',
+	'    except Exception as e:',
+	'        response = json.dumps({"id": request["id"], "error": str(e) or e.__class__.__name__})',
+	'    sys.stdout.write(response + "\\n")',
+	'    sys.stdout.flush()'
+].join('\n');
+
+// a single python process serves all the extractions, it is started on demand and stops when idle
+var blInfoWorker = null;
+
+function startBlInfoWorker() {
+	var worker = {
+		process: spawn('python', ['-c', blInfoScript]),
+		callbacks: {},
+		pending: 0,
+		nextId: 0,
+		buffer: '',
+		idleTimer: null
+	};
+	
+	function fail(err) {
+		if (blInfoWorker === worker) {
+			blInfoWorker = null;
+		}
+		clearTimeout(worker.idleTimer);
+		
+		var callbacks = worker.callbacks;
+		worker.callbacks = {};
+		worker.pending = 0;
+		for (var id in callbacks) {
+			callbacks[id](err);
+		}
 	}
-	options = merge(defaultOptions, options);
 	
-	if (!url) {
-		return callback('Please give an url');
+	worker.process.on('error', fail);
+	worker.process.on('exit', function(code) {
+		return fail(new Error('The bl_info worker exited with code ' + code + '.'));
+	});
+	worker.process.stdin.on('error', fail);
+	
+	worker.process.stdout.setEncoding('utf8');
+	worker.process.stdout.on('data', function(data) {
+		var lines = (worker.buffer + data).split('\n');
+		worker.buffer = lines.pop();
+		lines.forEach(function(line) {
+			var response = JSON.parse(line);
+			var callback = worker.callbacks[response.id];
+			if (!callback) {
+				return;
+			}
+			
+			delete worker.callbacks[response.id];
+			--worker.pending;
+			if (response.error) {
+				return callback(new Error(response.error));
+			}
+			return callback(null, response.info);
+		});
+		
+		if (!worker.pending) {
+			clearTimeout(worker.idleTimer);
+			worker.idleTimer = setTimeout(function() {
+				if (blInfoWorker === worker) {
+					blInfoWorker = null;
+				}
+				return worker.process.stdin.end();
+			}, workerIdleTimeout);
+		}
+	});
+	
+	return worker;
+}
+
+function extractBlInfo(content, callback) {
+	if (!blInfoWorker) {
+		blInfoWorker = startBlInfoWorker();
 	}
 	
+	var worker = blInfoWorker;
+	clearTimeout(worker.idleTimer);
+	
+	var id = worker.nextId++;
+	worker.callbacks[id] = callback;
+	++worker.pending;
+	return worker.process.stdin.write(JSON.stringify({
+		id: id,
+		source: content.toString()
+	}) + '\n');
+}
+
+function getHashAlgorithm(options) {
 	var hashAlgorithm = options.hash || 'sha256';
 	if (crypto.getHashes().indexOf(hashAlgorithm) === -1) {
 		throw hashAlgorithm + ' is not supported';
 	}
+	return hashAlgorithm;
+}
+
+function hashContent(content, hashAlgorithm) {
+	var h = crypto.createHash(hashAlgorithm);
+	h.update(content);
+	return h.digest('hex');
+}
+
+// reads the file or downloads the url, the validators of a previous download make the request conditional
+// content is null when the server answers that it has not changed
+function fetchSource(url, validators, callback) {
+	if (url.indexOf('://') === -1) {
+		return fs.readFile(url, function(err, content) {
+			return callback(err, content, {});
+		});
+	}
 	
-	function handleScript(name, content) {
-		var h = crypto.createHash(hashAlgorithm);
-		h.update(content);
-		var hash = h.digest('hex');
+	var headers = {};
+	if (validators && validators.etag) {
+		headers['If-None-Match'] = validators.etag;
+	}
+	if (validators && validators['last-modified']) {
+		headers['If-Modified-Since'] = validators['last-modified'];
+	}
+	
+	return request({
+		url: url,
+		encoding: null,
+		headers: headers
+	}, function(err, response, body) {
+		if (err) {
+			return callback(err);
+		}
 		
-		function addToAddons(name, content, file, peers, callback) {
-			return extractBlInfo(content, function(err, info) {
-				if (err) {
-					return callback(err);
-				}
-				
-				var fields = ['name', 'description', 'author', 'version', 'blender', 'location', 'category'];
-				for (var i = 0, n = fields.length; i < n; ++i) {
-					var field = fields[i];
-					if (!info.hasOwnProperty(field)) {
-						return callback(new Error('Missing field: ' + field + '.'));
-					}
-				}
-				
-				var addon = {
-					info: info,
-					url: url
-				};
-				
-				addon[hashAlgorithm] = hash;
-				
-				if (peers.length) {
-					addon.peers = peers;
-				}
-				
-				if (file) {
-					addon.file = file;
-				}
-				
-				addons[name] = addon;
-				
-				if (!options.simulate) {
-					return saveAddons(addons, function(err) {
-						return callback(err, addon);
-					});
-				} else {
-					return callback(null, addon);
+		if (response.statusCode === 304) {
+			return callback(null, null, validators);
+		}
+		
+		if (response.statusCode !== 200) {
+			return callback(new Error(response.statusCode + ': ' + body));
+		}
+		
+		var newValidators = {};
+		if (response.headers.etag) {
+			newValidators.etag = response.headers.etag;
+		}
+		if (response.headers['last-modified']) {
+			newValidators['last-modified'] = response.headers['last-modified'];
+		}
+		return callback(null, body, newValidators);
+	});
+}
+
+var tmpDirCounter = 0;
+
+// builds the records of a source, either a single script or the addons at the root of an archive
+// calls back with a list of {name, addon}, without touching the registry
+function describeSource(url, content, hash, options, callback) {
+	var hashAlgorithm = getHashAlgorithm(options);
+	
+	function describeScript(name, content, file, peers, callback) {
+		return extractBlInfo(content, function(err, info) {
+			if (err) {
+				return callback(err);
+			}
+			
+			var fields = ['name', 'description', 'author', 'version', 'blender', 'location', 'category'];
+			for (var i = 0, n = fields.length; i < n; ++i) {
+				var field = fields[i];
+				if (!info.hasOwnProperty(field)) {
+					return callback(new Error('Missing field: ' + field + '.'));
 				}
+			}
+			
+			var addon = {
+				info: info,
+				url: url
+			};
+			
+			addon[hashAlgorithm] = hash;
+			
+			if (peers.length) {
+				addon.peers = peers;
+			}
+			
+			if (file) {
+				addon.file = file;
+			}
+			
+			return callback(null, {
+				name: name,
+				addon: addon
 			});
+		});
+	}
+	
+	var name = (url.indexOf('://') !== -1 ? bareName(url.split('/').pop()) : bareName(url));
+	return describeScript(name, content, true, [], function(err, record) {
+		if (!err) {
+			return callback(null, [record]);
 		}
 		
-		return addToAddons(name, content, true, [], function(err, addon) {
-			if (err) {
-				return async.waterfall([
-					function(callback) {
-						return rimraf('tmp', callback);
-					},
-					function(callback) {
-						return fs.mkdir('tmp', callback);
-					},
-					function(callback) {
-						return fs.writeFile('tmp/download', content, callback);
-					},
-					function(callback) {
-						return execFile('7z', ['x', '-otmp/archive', 'tmp/download'], callback);
-					},
-					function(stdout, stderr, callback) {
-						var archiveDir = 'tmp/archive';
-						return fs.readdir(archiveDir, function(err, files) {
+		// each source gets its own directory, as several are extracted at the same time
+		var tmpDir = path.join('tmp', process.pid + '-' + (++tmpDirCounter)),
+			downloadFile = path.join(tmpDir, 'download'),
+			archiveDir = path.join(tmpDir, 'archive');
+		
+		return async.waterfall([
+			function(callback) {
+				return fs.mkdir('tmp', function(err) {
+					return callback(err && err.code !== 'EEXIST' ? err : null);
+				});
+			},
+			function(callback) {
+				return rimraf(tmpDir, callback);
+			},
+			function(callback) {
+				return fs.mkdir(tmpDir, callback);
+			},
+			function(callback) {
+				return fs.writeFile(downloadFile, content, callback);
+			},
+			function(callback) {
+				return execFile('7z', ['x', '-o' + archiveDir, downloadFile], callback);
+			},
+			function(stdout, stderr, callback) {
+				return fs.readdir(archiveDir, function(err, files) {
+					if (err) {
+						return callback(err);
+					}
+					
+					return async.map(files, function(file, callback) {
+						var ext = path.extname(file);
+						if (file === '__MACOSX' || (ext !== '' && ext !== '.py')) {
+							return callback();
+						}
+						
+						var archiveFile = path.join(archiveDir, file);
+						return fs.stat(archiveFile, function(err, stats) {
 							if (err) {
 								return callback(err);
 							}
 							
-							return async.map(files, function(file, callback) {
-								var ext = path.extname(file);
-								if (file === '__MACOSX' || ext !== '' || ext !== '.py') {
-									return callback();
-								}
-								
-								var archiveFile = path.join(archiveDir, file);
-								return fs.stat(archiveFile, function(err, stats) {
-									if (err) {
-										return callback(err);
-									}
-									
-									if (stats.isFile()) {
-										return fs.readFile(archiveFile, function(err, content) {
-											return callback(err, [bareName(file), content, false]);
-										});
-									}
-									
-									if (stats.isDirectory()) {
-										return fs.readFile(path.join(archiveFile, '__init__.py'), function(err, content) {
-											return callback(err, [file, content, false]);
-										});
-									}
-									
-									return callback();
+							if (stats.isFile()) {
+								return fs.readFile(archiveFile, function(err, content) {
+									return callback(err, [bareName(file), content, false]);
 								});
-							}, callback);
-						});
-					},
-					function(descs, callback) {
-						descs = descs.filter(function(desc) {
-							return !!desc;
-						});
-						
-						return async.map(descs, function(desc, callback) {
-							desc.push(descs.filter(function(d) {
-								return d !== desc;
-							}).map(function(d) {
-								return d[0];
-							}));
-							desc.push(callback);
-							return addToAddons.apply(this, desc);
-						}, callback);
-					},
-					function(addons, callback) {
-						return rimraf('tmp', function(err) {
-							return callback(err, addons);
+							}
+							
+							if (stats.isDirectory()) {
+								return fs.readFile(path.join(archiveFile, '__init__.py'), function(err, content) {
+									return callback(err, [file, content, false]);
+								});
+							}
+							
+							return callback();
 						});
-					}
-				], callback);
-			} else {
-				return callback(null, addon);
+					}, callback);
+				});
+			},
+			function(descs, callback) {
+				descs = descs.filter(function(desc) {
+					return !!desc;
+				});
+				
+				return async.map(descs, function(desc, callback) {
+					desc.push(descs.filter(function(d) {
+						return d !== desc;
+					}).map(function(d) {
+						return d[0];
+					}));
+					desc.push(callback);
+					return describeScript.apply(this, desc);
+				}, callback);
 			}
+		], function(err, records) {
+			return rimraf(tmpDir, function() {
+				return callback(err, records);
+			});
 		});
+	});
+}
+
+// the mirrors are not found in the source, they are edited by hand in addons.json
+function keepMirrors(record) {
+	var previous = addons[record.name];
+	if (previous && previous.mirrors) {
+		record.addon.mirrors = previous.mirrors;
+	}
+}
+
+exports.add = function(url, options, callback) {
+	if (!callback) {
+		callback = options;
+		options = {};
+	}
+	options = merge(defaultOptions, options);
+	
+	if (!url) {
+		return callback('Please give an url');
 	}
 	
-	if (url.indexOf('://') !== -1) {
-		return request({
-			url: url,
-			encoding: null
-		}, function(err, response, body) {
+	var hashAlgorithm = getHashAlgorithm(options);
+	
+	return fetchSource(url, null, function(err, content) {
+		if (err) {
+			return callback(err);
+		}
+		
+		return describeSource(url, content, hashContent(content, hashAlgorithm), options, function(err, records) {
 			if (err) {
 				return callback(err);
 			}
 			
-			if (response.statusCode !== 200) {
-				return callback(new Error(response.statusCode + ': ' + body));
-			}
+			records.forEach(function(record) {
+				keepMirrors(record);
+				if (!options.simulate) {
+					recordChange(record.name, record.addon);
+				}
+				addons[record.name] = record.addon;
+			});
+			
+			var result = (records.length === 1 && records[0].addon.file ? records[0].addon : records.map(function(record) {
+				return record.addon;
+			}));
 			
-			return handleScript(bareName(url.split('/').pop()), body);
+			if (!options.simulate) {
+				return saveAddons(options, function(err) {
+					return callback(err, result);
+				});
+			} else {
+				return callback(null, result);
+			}
 		});
-	} else {
-		return fs.readFile(url, function(err, content) {
-			if (err) return callback(err);
-			return handleScript(path.basename(url, path.extname(url)), content);
+	});
+};
+
+function readSources() {
+	try {
+		return JSON.parse(fs.readFileSync(sourcesFile));
+	} catch (err) {
+		return {};
+	}
+}
+
+// refreshes every source of the registry, plus the given urls, then writes addons.json once
+// addons.sources.json remembers the validators and the hash of each source, so that the unchanged ones are skipped
+exports.rebuild = function(urls, options, callback) {
+	if (!callback) {
+		callback = options;
+		options = urls;
+		urls = [];
+	}
+	if (!callback) {
+		callback = options;
+		options = {};
+	}
+	options = merge(defaultOptions, options);
+	
+	var hashAlgorithm = getHashAlgorithm(options);
+	var concurrency = options.concurrency || defaultOptions.concurrency;
+	
+	var namesByUrl = {};
+	for (var name in addons) {
+		var url = addons[name].url;
+		(namesByUrl[url] = namesByUrl[url] || []).push(name);
+	}
+	urls.forEach(function(url) {
+		namesByUrl[url] = namesByUrl[url] || [];
+	});
+	
+	var sources = readSources(),
+		newSources = {},
+		rebuilt = {},
+		stats = {
+			sources: 0,
+			unchanged: 0,
+			changed: 0,
+			failed: 0
+		};
+	
+	function keep(url) {
+		namesByUrl[url].forEach(function(name) {
+			rebuilt[name] = addons[name];
 		});
 	}
+	
+	return async.eachLimit(Object.keys(namesByUrl), concurrency, function(url, callback) {
+		++stats.sources;
+		
+		// the previous download is only trusted if the registry still has all its records
+		var source = sources[url];
+		if (source && (source.algorithm !== hashAlgorithm || source.names.join() !== namesByUrl[url].slice().sort().join())) {
+			source = null;
+		}
+		
+		return fetchSource(url, source && source.validators, function(err, content, validators) {
+			if (err) {
+				console.error(url + ': ' + (err.message || err));
+				++stats.failed;
+				keep(url);
+				return callback();
+			}
+			
+			if (content === null) {
+				++stats.unchanged;
+				keep(url);
+				newSources[url] = source;
+				return callback();
+			}
+			
+			var hash = hashContent(content, hashAlgorithm);
+			if (source && source.hash === hash) {
+				++stats.unchanged;
+				keep(url);
+				source.validators = validators;
+				newSources[url] = source;
+				return callback();
+			}
+			
+			return describeSource(url, content, hash, options, function(err, records) {
+				if (err) {
+					console.error(url + ': ' + (err.message || err));
+					++stats.failed;
+					keep(url);
+					return callback();
+				}
+				
+				++stats.changed;
+				records.forEach(function(record) {
+					keepMirrors(record);
+					rebuilt[record.name] = record.addon;
+				});
+				newSources[url] = {
+					validators: validators,
+					algorithm: hashAlgorithm,
+					hash: hash,
+					names: records.map(function(record) {
+						return record.name;
+					}).sort()
+				};
+				return callback();
+			});
+		});
+	}, function(err) {
+		if (err) {
+			return callback(err);
+		}
+		
+		if (!options.simulate) {
+			for (var name in rebuilt) {
+				recordChange(name, rebuilt[name]);
+			}
+	
+			// records which disappeared from their source are removed
+			for (var name in addons) {
+				if (!rebuilt.hasOwnProperty(name)) {
+					recordChange(name, null);
+				}
+			}
+		}
+		
+		// sorted, so that the file does not change when the sources come back in another order
+		Object.keys(addons).forEach(function(name) {
+			delete addons[name];
+		});
+		Object.keys(rebuilt).sort().forEach(function(name) {
+			addons[name] = rebuilt[name];
+		});
+		
+		console.log(stats.sources + ' sources, ' + stats.unchanged + ' unchanged, ' + stats.changed + ' changed, ' + stats.failed + ' failed');
+		
+		if (options.simulate) {
+			return callback(null, stats);
+		}
+		
+		return saveAddons({
+			compact: true,
+			keepDeltas: options.keepDeltas || options['keep-deltas']
+		}, function(err) {
+			if (err) {
+				return callback(err);
+			}
+			
+			return writeFileAtomically(sourcesFile, JSON.stringify(newSources), function(err) {
+				return callback(err, stats);
+			});
+		});
+	});
 };
 
 exports.list = function(options, callback) {
@@ -261,10 +702,13 @@ exports.remove = function(name, options, callback) {
 		return callback(name + " is not in the registry");
 	}
 	
+	if (!options.simulate) {
+		recordChange(name, null);
+	}
 	delete addons[name];
 	
 	if (!options.simulate) {
-		return saveAddons(callback);
+		return saveAddons(options, callback);
 	} else {
 		return callback();
 	}
@@ -274,10 +718,22 @@ if (require.main === module) {
 	ycommands = require('ycommands')
 		.usage('Usage: $0 command')
 		.help('h')
+		.options('compact', {
+			boolean: true,
+			description: 'Write addons.json without indentation'
+		})
+		.options('concurrency', {
+			default: defaultOptions.concurrency,
+			description: 'Number of sources fetched at the same time by rebuild'
+		})
 		.options('hash', {
 			default: defaultOptions.hash,
 			description: 'Hash algorithm'
 		})
+		.options('keep-deltas', {
+			default: defaultOptions.keepDeltas,
+			description: 'Number of deltas kept for the clients using ' + manifestFile
+		})
 		.option('s', {
 			alias: 'simulate',
 			boolean: true,
@@ -289,6 +745,11 @@ if (require.main === module) {
 			}, callback);
 		})
 		.command('list', 'List addons', exports.list)
+		.command('rebuild [url|path ...]', 'Refresh all the sources, plus some new ones, and write addons.json once', function(argv, callback) {
+			return exports.rebuild(argv._.slice(1), argv, function(err) {
+				return callback(err);
+			});
+		})
 		.command('remove name ...', 'Remove some addons', function(argv, callback) {
 			return async.each(argv._.slice(1), function(name, callback) {
 				return exports.remove(name, argv, callback);
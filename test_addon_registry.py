@@ -0,0 +1,384 @@
+# Tests of the addon registry, run outside of Blender:
+# python -m pytest test_addon_registry.py
+
+import addon_registry as registry
+import copy
+import functools
+import hashlib
+import http.server
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+import zipfile
+
+class ExtractZipTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="addon_registry_test-")
+        self.configuration = dict(registry.configuration)
+        self.parallel_extract_min_size = registry.parallel_extract_min_size
+        registry.configuration["extract-concurrency"] = 8
+        registry.parallel_extract_min_size = 0
+    
+    def tearDown(self):
+        registry.configuration.clear()
+        registry.configuration.update(self.configuration)
+        registry.parallel_extract_min_size = self.parallel_extract_min_size
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+    
+    # many members per new directory, extracted by several threads at the same time
+    def test_parallel_extraction_of_shared_directories(self):
+        download_path = os.path.join(self.work_dir, "download")
+        members = dict()
+        with zipfile.ZipFile(download_path, 'w', zipfile.ZIP_STORED) as zf:
+            zf.writestr("addon/__init__.py", b"bl_info = {'name': 'addon'}\n")
+            members["addon/__init__.py"] = b"bl_info = {'name': 'addon'}\n"
+            for i in range(160):
+                name = "addon/data/%d/%d.bin" % (i % 2, i)
+                members[name] = os.urandom(1024)
+                zf.writestr(name, members[name])
+        
+        for run in range(30):
+            extract_dir = os.path.join(self.work_dir, "extract-%d" % run)
+            registry.extract_zip(["addon"], download_path, extract_dir, {})
+            for name, content in members.items():
+                with open(os.path.join(extract_dir, *name.split("/")), 'rb') as f:
+                    self.assertEqual(f.read(), content)
+
+class ViewRowsTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="addon_registry_test-")
+        self.configuration = copy.deepcopy(registry.configuration)
+        self.scripts_dir = registry.scripts_dir
+        
+        registry.scripts_dir = os.path.join(self.work_dir, "scripts")
+        os.makedirs(os.path.join(registry.scripts_dir, "addons"))
+        registry.configuration["registries"] = []
+        registry.configuration["addons"] = {
+            "mesh_tools": {"info": {"name": "Mesh Tools", "author": "Alice", "description": "Edit meshes", "category": "Mesh", "version": [1, 0]}},
+            "uv_pack": {"info": {"name": "UV Pack", "author": "Bob", "description": "abca cab", "category": "UV", "version": [1, 0]}},
+            "rigify": {"info": {"name": "Rigify", "author": "Carol", "description": "Rig meshes", "category": "Rigging", "version": [1, 0]}},
+        }
+        registry.database_loaded = True
+        registry.installed_addons_dirs = None
+        registry.installed_addons_scanned.clear()
+        registry.sort_addonds()
+        registry.database_revision += 1
+    
+    def tearDown(self):
+        registry.configuration.clear()
+        registry.configuration.update(self.configuration)
+        registry.scripts_dir = self.scripts_dir
+        registry.installed_addons_dirs = None
+        registry.installed_addons_scanned.clear()
+        registry.sort_addonds()
+        registry.database_revision += 1
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+    
+    def get_names(self, filter, search):
+        return [row["name"] for row in registry.get_view_rows(filter, search)]
+    
+    def test_trigram_candidates(self):
+        index = registry.get_search_index()
+        self.assertIsNone(registry.lookup_trigrams(index, "me"))
+        names = [name for name, addon in registry.sorted_addons]
+        self.assertEqual({names[i] for i in registry.lookup_trigrams(index, "meshes")}, {"mesh_tools", "rigify"})
+        self.assertEqual(registry.lookup_trigrams(index, "zzz"), set())
+    
+    # the trigrams only give candidates, which are verified against the whole search
+    def test_candidates_are_verified(self):
+        index = registry.get_search_index()
+        self.assertTrue(registry.lookup_trigrams(index, "abcab"))
+        self.assertEqual(self.get_names("All", "abcab"), [])
+        self.assertEqual(self.get_names("All", "abca"), ["uv_pack"])
+    
+    def test_filter_and_search(self):
+        self.assertEqual(sorted(self.get_names("All", "")), ["mesh_tools", "rigify", "uv_pack"])
+        self.assertEqual(sorted(self.get_names("All", "meshes")), ["mesh_tools", "rigify"])
+        self.assertEqual(self.get_names("Rigging", "meshes"), ["rigify"])
+        self.assertEqual(self.get_names("Mesh", "carol"), [])
+        # too short for the trigrams, every row is scanned
+        self.assertEqual(self.get_names("All", "bo"), ["uv_pack"])
+        self.assertEqual(self.get_names("Installed", ""), [])
+        self.assertEqual(len(self.get_names("Not Installed", "")), 3)
+
+class MergeDeltasTest(unittest.TestCase):
+    def setUp(self):
+        self.registries = [{"url": "first"}, {"url": "second", "report-url": "second/issues"}]
+        self.addons = {
+            "a": {"info": {"version": [1]}, "registry-url": "first"},
+            "b": {"info": {"version": [1]}, "registry-url": "second"},
+        }
+    
+    # a later registry overrides the records of an earlier one, not the other way around
+    def test_ownership(self):
+        deltas = {
+            "first": [{"changed": {"b": {"info": {"version": [2]}}, "c": {"info": {"version": [1]}}}}],
+            "second": [{"changed": {"a": {"info": {"version": [3]}}}}],
+        }
+        self.assertTrue(registry.merge_deltas(self.addons, self.registries, deltas))
+        self.assertEqual(self.addons["a"], {"info": {"version": [3]}, "registry-url": "second", "registry-report-url": "second/issues"})
+        self.assertEqual(self.addons["b"]["info"]["version"], [1])
+        self.assertEqual(self.addons["c"]["registry-url"], "first")
+    
+    def test_removal(self):
+        deltas = {"first": [{"removed": ["a", "b", "missing"]}]}
+        self.assertTrue(registry.merge_deltas(self.addons, self.registries, deltas))
+        self.assertEqual(sorted(self.addons), ["b"])
+    
+    # an earlier registry may define the record removed by a later one, only a full merge knows
+    def test_removal_from_later_registry_needs_full_merge(self):
+        deltas = {"second": [{"removed": ["b"]}]}
+        self.assertFalse(registry.merge_deltas(self.addons, self.registries, deltas))
+
+class NormalizeVersionTest(unittest.TestCase):
+    def test_trailing_zeros(self):
+        self.assertEqual(registry.normalize_version((1, 2)), registry.normalize_version((1, 2, 0)))
+        self.assertEqual(registry.normalize_version("1.2.0"), (1, 2))
+        self.assertFalse(registry.is_newer_version((1, 2, 0), (1, 2)))
+        self.assertTrue(registry.is_newer_version((1, 2, 1), (1, 2)))
+    
+    def test_strings(self):
+        self.assertEqual(registry.normalize_version("2b"), (2,))
+        self.assertEqual(registry.normalize_version(" 1.10 "), (1, 10))
+        self.assertTrue(registry.is_newer_version("1.10", (1, 9)))
+        self.assertTrue(registry.is_newer_version(3, "2.9"))
+
+class MemberPathTest(unittest.TestCase):
+    def test_unsafe_members_are_rejected(self):
+        for name in ("C:/Users/x/evil.py", "C:evil.py", "addon/D:/evil.py", "../evil.py", "addon/../../evil.py", "\\\\server\\share\\..\\evil.py"):
+            self.assertIsNone(registry.get_member_parts(name), name)
+        self.assertEqual(registry.get_member_parts("/addon//./__init__.py"), ["addon", "__init__.py"])
+    
+    # members are not written through a link leaving the extraction directory
+    @unittest.skipUnless(hasattr(os, "symlink"), "symbolic links are not supported")
+    def test_member_path_stays_in_extract_dir(self):
+        work_dir = tempfile.mkdtemp(prefix="addon_registry_test-")
+        self.addCleanup(shutil.rmtree, work_dir, True)
+        extract_dir = os.path.join(work_dir, "extract")
+        os.makedirs(extract_dir)
+        os.symlink(work_dir, os.path.join(extract_dir, "link"))
+        
+        self.assertEqual(registry.get_member_path(extract_dir, ["addon", "__init__.py"]), os.path.join(extract_dir, "addon", "__init__.py"))
+        with self.assertRaises(ValueError):
+            registry.get_member_path(extract_dir, ["link", "evil.py"])
+
+class InstallTest(unittest.TestCase):
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp(prefix="addon_registry_test-")
+        self.configuration = copy.deepcopy(registry.configuration)
+        self.scripts_dir = registry.scripts_dir
+        
+        registry.scripts_dir = os.path.join(self.work_dir, "scripts")
+        os.makedirs(os.path.join(registry.scripts_dir, "addons"))
+        registry.configuration["registries"] = []
+        registry.configuration["download-cache-size"] = 0
+        registry.database_loaded = True
+        registry.installed_addons_dirs = None
+        registry.installed_addons_scanned.clear()
+        registry.mirror_scores = None
+        
+        content = b"bl_info = {'name': 'pinned', 'version': (1, 0)}\n"
+        self.source_path = os.path.join(self.work_dir, "pinned.py")
+        with open(self.source_path, 'wb') as f:
+            f.write(content)
+        self.sha256 = hashlib.sha256(content).hexdigest()
+        self.blake2b512 = hashlib.blake2b(content).hexdigest()
+    
+    def tearDown(self):
+        registry.configuration.clear()
+        registry.configuration.update(self.configuration)
+        registry.scripts_dir = self.scripts_dir
+        registry.installed_addons_dirs = None
+        registry.installed_addons_scanned.clear()
+        registry.mirror_scores = None
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+    
+    def set_record(self, **hashes):
+        record = {"info": {"name": "pinned", "category": "System", "version": [1, 0]}, "url": self.source_path, "file": True}
+        record.update(hashes)
+        registry.configuration["addons"] = {"pinned": record}
+        registry.sort_addonds()
+    
+    # the hash of a report is accepted back as a lock
+    def test_report_hash_as_lock(self):
+        self.set_record(sha256=self.sha256, blake2b512=self.blake2b512)
+        report = registry.provision({"pinned": None}, update_database=False)
+        self.assertEqual(report["addons"]["pinned"]["hash"], "blake2b512-" + self.blake2b512)
+        
+        report = registry.provision({"pinned": report["addons"]["pinned"]["hash"]}, update_database=False, force=True)
+        self.assertEqual(report["addons"]["pinned"]["error"], registry.ERROR_NONE)
+        report = registry.provision({"pinned": self.sha256}, update_database=False, force=True)
+        self.assertEqual(report["addons"]["pinned"]["error"], registry.ERROR_NONE)
+    
+    # the download is verified against the locked hash, even if the record prefers another one
+    def test_locked_hash_is_verified(self):
+        with open(self.source_path, 'ab') as f:
+            f.write(b"# tampered\n")
+        with open(self.source_path, 'rb') as f:
+            self.set_record(sha256=self.sha256, blake2b512=hashlib.blake2b(f.read()).hexdigest())
+        
+        report = registry.provision({"pinned": self.sha256}, update_database=False)
+        self.assertEqual(report["addons"]["pinned"]["error"], registry.ERROR_HASH_MISMATCH)
+        
+        report = registry.provision({"pinned": "sha512-" + hashlib.sha512(b"").hexdigest()}, update_database=False)
+        self.assertEqual(report["addons"]["pinned"]["error"], registry.ERROR_LOCK_MISMATCH)
+
+    # the directories scanned before the install are not scanned again after it
+    def test_install_updates_only_the_installed_entries(self):
+        self.set_record(sha256=self.sha256)
+        registry.get_addon_dir(create=True)
+        # the first scan creates the cache directory, which changes the mtime of scripts/addons
+        registry.scan_installed_addons()
+        registry.scan_installed_addons()
+        with unittest.mock.patch.object(registry, "scan_installed_addons_dir", wraps=registry.scan_installed_addons_dir) as scan:
+            self.assertEqual(registry.install("pinned"), registry.ERROR_NONE)
+            self.assertEqual(scan.call_count, 0)
+        # the staging directory is deleted in the background, which changes the mtime again, so the index is read
+        # without scanning
+        self.assertEqual(list(registry.installed_addons["pinned"]["version"]), [1, 0])
+    
+    # a swap failing halfway puts the installed module back, instead of leaving the addon without module
+    def test_failed_swap_is_rolled_back(self):
+        self.set_record(sha256=self.sha256)
+        self.assertEqual(registry.install("pinned"), registry.ERROR_NONE)
+        installed_path = os.path.join(registry.get_addon_dir(), "pinned.py")
+        with open(installed_path, 'rb') as f:
+            installed_content = f.read()
+        
+        content = b"bl_info = {'name': 'pinned', 'version': (2, 0)}\n"
+        with open(self.source_path, 'wb') as f:
+            f.write(content)
+        self.set_record(sha256=hashlib.sha256(content).hexdigest())
+        
+        rename = os.rename
+        def failing_rename(source, destination):
+            # e.g. a sharing violation on Windows when the staged module is moved in place
+            if ".extract" in source and ".extract" not in destination:
+                raise PermissionError(source)
+            return rename(source, destination)
+        
+        with unittest.mock.patch("os.rename", failing_rename):
+            self.assertEqual(registry.install("pinned"), registry.ERROR_FAILED_COPY)
+        with open(installed_path, 'rb') as f:
+            self.assertEqual(f.read(), installed_content)
+        self.assertEqual([name for name in os.listdir(registry.get_addon_dir()) if name.endswith(".old")], [])
+    
+    def write_partial(self, hash, age=0):
+        path = os.path.join(registry.get_addon_dir(create=True), ".addon_registry-%s.partial" % hash)
+        with open(path, 'wb') as f:
+            f.write(b"#" * 1024)
+        mtime = time.time() - age
+        os.utime(path, (mtime, mtime))
+        return path
+    
+    def wait_for_deletions(self):
+        thread = registry.retired_modules_thread
+        if thread:
+            thread.join()
+    
+    # partial downloads are deleted once too old or once no record has their hash
+    def test_partial_downloads_expire(self):
+        self.set_record(sha256=self.sha256, blake2b512=self.blake2b512)
+        resumable_path = self.write_partial("blake2b512-" + self.blake2b512)
+        old_path = self.write_partial(self.sha256, registry.partial_download_expiry + 60)
+        orphan_path = self.write_partial("0" * 64)
+        
+        registry.scan_installed_addons()
+        self.wait_for_deletions()
+        self.assertTrue(os.path.exists(resumable_path))
+        self.assertFalse(os.path.exists(old_path))
+        self.assertFalse(os.path.exists(orphan_path))
+    
+    # partial downloads count in the size of the download cache
+    def test_partial_downloads_are_evicted(self):
+        self.set_record(sha256=self.sha256)
+        partial_path = self.write_partial(self.sha256)
+        registry.configuration["download-cache-size"] = 1024 * 1024
+        registry.evict_download_cache(registry.get_download_cache_dirs()[0])
+        self.assertTrue(os.path.exists(partial_path))
+        
+        registry.configuration["download-cache-size"] = 512
+        registry.evict_download_cache(registry.get_download_cache_dirs()[0])
+        self.assertFalse(os.path.exists(partial_path))
+    
+    # the first install creates addons_extern, which Blender has to know about to enable its addons
+    def test_refresh_after_first_install(self):
+        self.set_record(sha256=self.sha256)
+        self.assertEqual(registry.install("pinned"), registry.ERROR_NONE)
+        
+        bpy = unittest.mock.Mock()
+        addon_utils = unittest.mock.Mock()
+        addon_utils.paths.return_value = [registry.get_addon_dir(dir="addons")]
+        addon_utils.modules.return_value = []
+        context = unittest.mock.Mock()
+        context.user_preferences.addons = []
+        with unittest.mock.patch.object(registry, "bpy", bpy), unittest.mock.patch.object(registry, "addon_utils", addon_utils):
+            registry.refresh_installed_addons(context, ["pinned"])
+        
+        bpy.utils.refresh_script_paths.assert_called_once_with()
+        addon_utils.modules.assert_called_with(refresh=True)
+        bpy.ops.script.reload.assert_not_called()
+    
+    # outside of Blender, an archive which has to be extracted manually is left for the caller
+    @unittest.skipIf(shutil.which("7z"), "7z extracts any archive")
+    def test_extract_manually_without_blender(self):
+        content = b"not an archive"
+        archive_path = os.path.join(self.work_dir, "pinned.rar")
+        with open(archive_path, 'wb') as f:
+            f.write(content)
+        registry.configuration["addons"] = {"pinned": {"info": {"name": "pinned", "category": "System", "version": [1, 0]}, "url": archive_path, "sha256": hashlib.sha256(content).hexdigest()}}
+        registry.sort_addonds()
+        
+        manual_downloads = dict()
+        self.assertEqual(registry.install("pinned", manual_downloads), registry.ERROR_EXTRACT_MANUALLY)
+        with open(manual_downloads["pinned"], 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def write_tar(self, path, files):
+        with tarfile.open(path, 'w:gz') as tf:
+            for name, content in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tf.addfile(info, io.BytesIO(content))
+    
+    def start_server(self, directory):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(http.server.SimpleHTTPRequestHandler, directory=directory))
+        server.RequestHandlerClass.log_message = lambda *args: None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return "http://127.0.0.1:%d/" % server.server_address[1]
+    
+    # the tar extracted while it is downloaded from a mirror failing the hash check is not installed with the
+    # download of the next mirror
+    def test_mirror_after_hash_mismatch_of_streamed_tar(self):
+        served_dir = os.path.join(self.work_dir, "served")
+        mirror_dir = os.path.join(self.work_dir, "mirror")
+        os.makedirs(served_dir)
+        os.makedirs(mirror_dir)
+        self.write_tar(os.path.join(served_dir, "pinned.tar.gz"), {"pinned/__init__.py": b"bl_info = {'name': 'pinned', 'version': (6, 6, 6)}\n"})
+        self.write_tar(os.path.join(mirror_dir, "pinned.tar.gz"), {"pinned/__init__.py": b"bl_info = {'name': 'pinned', 'version': (1, 0)}\n"})
+        with open(os.path.join(mirror_dir, "pinned.tar.gz"), 'rb') as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        
+        registry.configuration["mirrors-race"] = 1
+        registry.configuration["addons"] = {"pinned": {
+            "info": {"name": "pinned", "category": "System", "version": [1, 0]},
+            "url": self.start_server(served_dir) + "pinned.tar.gz",
+            "mirrors": [os.path.join(mirror_dir, "pinned.tar.gz")],
+            "sha256": sha256,
+        }}
+        registry.sort_addonds()
+        
+        self.assertEqual(registry.install("pinned"), registry.ERROR_NONE)
+        with open(os.path.join(registry.get_addon_dir(), "pinned", "__init__.py"), 'rb') as f:
+            self.assertIn(b"(1, 0)", f.read())
+
+if __name__ == "__main__":
+    unittest.main()